@@ -12,7 +12,8 @@ class SiteConfigurationAdmin(SingletonModelAdmin):
                                                'get_cards_available')}),
                  (None, {'fields': (('lower_limit', 'increase_by',),)}),
                  (None, {'fields': ('email_subject',)}),
-                 (None, {'fields': ('card_letters',)}),)
+                 (None, {'fields': ('card_letters',)}),
+                 (None, {'fields': ('retention_months',)}),)
 
     def get_cards_available(self, obj):
         return Customer.objects.avail_cards_count()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import time
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import transaction
+from django.utils.crypto import get_random_string
+
+
+class CacheVersion(object):
+    """
+    Random token in the shared cache; ``bump`` replaces it after the current
+    transaction commits so every worker sees the change.
+    """
+    def __init__(self, key):
+        self.key = key
+
+    def get(self):
+        version = cache.get(self.key)
+        if version is None:
+            version = get_random_string(12)
+            if not cache.add(self.key, version, None):
+                version = cache.get(self.key)
+        return version
+
+    def bump(self):
+        transaction.on_commit(
+            lambda: cache.set(self.key, get_random_string(12), None)
+        )
+
+
+class VersionedCache(object):
+    """
+    Keeps a value in process memory and compares a version token stored in
+    the shared cache at most once per request (or every ``timeout`` seconds
+    outside of requests) so that every worker drops its copy after
+    ``invalidate`` is called anywhere.
+
+    The cached value is shared, treat it as read-only.
+    """
+    def __init__(self, key, loader, timeout=None):
+        self.token = CacheVersion(key)
+        self.loader = loader
+        self.timeout = timeout
+        self.value = None
+        self.version = None
+        self.checked_at = 0
+        request_started.connect(self.expire, weak=False)
+
+    def get_timeout(self):
+        if self.timeout is None:
+            return getattr(settings, 'LOCAL_CACHE_TIMEOUT', 60)
+        return self.timeout
+
+    def get(self):
+        now = time.time()
+        if self.version is not None \
+                and now - self.checked_at < self.get_timeout():
+            return self.value
+        version = self.token.get()
+        if version != self.version:
+            self.value = self.loader()
+            self.version = version
+        self.checked_at = now
+        return self.value
+
+    def expire(self, **kwargs):
+        self.checked_at = 0
+
+    def clear(self):
+        self.value = self.version = None
+
+    def invalidate(self):
+        """
+        Changes the version token once the current transaction commits.
+        """
+        self.clear()
+        self.token.bump()
+
+
+class PageCache(object):
+    """
+    Rendered pages in the shared cache under ``prefix`` and a list of key
+    parts (versions). After a miss only the worker holding the lock renders
+    the page; others serve the previously rendered copy or wait for the new
+    one up to ``wait`` seconds.
+    """
+    def __init__(self, prefix, timeout=None, lock_timeout=30, wait=3):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+
+    def get(self, parts, render):
+        key = ':'.join([self.prefix] + list(parts))
+        content = cache.get(key)
+        if content is not None:
+            return content
+
+        stale_key = '%s:stale' % self.prefix
+        lock_key = '%s:lock' % self.prefix
+        if cache.add(lock_key, 1, self.lock_timeout):
+            try:
+                content = render()
+                cache.set_many({key: content, stale_key: content},
+                               self.timeout)
+            finally:
+                cache.delete(lock_key)
+            return content
+
+        content = cache.get(stale_key)
+        deadline = time.time() + self.wait
+        while content is None and time.time() < deadline:
+            time.sleep(0.05)
+            content = cache.get(key)
+        return render() if content is None else content
+
+
+class LRUCache(object):
+    """
+    Thread-safe in-memory mapping that keeps ``maxsize`` recently used keys.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return default
+            self.data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
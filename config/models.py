@@ -2,8 +2,12 @@
 from __future__ import unicode_literals
 
 from django.db import models
+from django.dispatch import receiver
+from django.db.models.signals import post_save
 from solo.models import SingletonModel
 
+from config.cache import VersionedCache
+
 
 class SiteConfiguration(SingletonModel):
     class Meta:
@@ -23,8 +27,40 @@ class SiteConfiguration(SingletonModel):
 
     card_letters = models.CharField(verbose_name='Буквенная часть карты', max_length=5, default='UTK')
 
+    retention_months = models.PositiveIntegerField(
+        'Хранить пользователей, месяцев', default=0,
+        help_text='Более старые пользователи и их письма переносятся в архив '
+                  'командой archive_customers; 0 - не переносить.'
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(SiteConfiguration, cls).from_db(db, field_names,
+                                                         values)
+        # The stored range, the card pool is rebuilt when it changes
+        instance._card_range = (instance.__dict__.get('card_start'),
+                                instance.__dict__.get('card_end'))
+        return instance
+
     def get_cards_range(self):
         return xrange(self.card_end, self.card_start - 1, -1)
 
     def get_cards_count(self):
         return self.card_end - self.card_start + 1
+
+    @classmethod
+    def get_cached(cls):
+        """
+        Shared read-only instance, reloaded after the configuration is saved
+        by any worker. Pass it explicitly into loops.
+        """
+        return site_config.get()
+
+
+site_config = VersionedCache('config:siteconfiguration',
+                             SiteConfiguration.get_solo)
+
+
+@receiver(post_save, sender=SiteConfiguration)
+def on_site_configuration_save(sender, **kwargs):
+    site_config.invalidate()
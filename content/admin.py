@@ -1,16 +1,25 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import os
 from datetime import date, timedelta
 
 from django.db import models
 from django.contrib import admin
 from django.contrib.admin.options import IncorrectLookupParameters
-from django.http import HttpResponseBadRequest, HttpResponse, Http404
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR
+from django.http import HttpResponseBadRequest, HttpResponse, Http404, \
+    StreamingHttpResponse, FileResponse, HttpResponseRedirect
+from django.core.urlresolvers import reverse
+from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
+from django.utils.html import format_html
 from django.utils import timezone
 from django.conf.urls import url
 
 from content.export import customer as export
-from content.models import Customer, Text, EmailTask, Service
+from content.paginator import KeysetPaginator
+from content.models import Customer, Text, EmailTask, Service, ExportJob, \
+    ImportJob, PurgeJob, JobStatus, CustomerArchive, EmailTaskArchive
 from content.views.admin import ImportView, CleanView
 
 
@@ -60,30 +69,106 @@ DateFieldListFilter.register(lambda f: isinstance(f, models.DateField),
                              take_priority=True)
 
 
-class CustomerAdmin(admin.ModelAdmin):
+# Query string keys of the rows around the requested page
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist whose links to the adjacent pages carry the keys of the
+    rows around them, so KeysetPaginator seeks to them without OFFSET.
+    """
+    def get_queryset(self, request):
+        # Runs right after the query string is copied; the keys are not
+        # lookups and are not kept in the other links
+        self.params.pop(AFTER_VAR, None)
+        self.params.pop(BEFORE_VAR, None)
+        return super(KeysetChangeList, self).get_queryset(request)
+
+    @cached_property
+    def page_keys(self):
+        """
+        Maps the adjacent page numbers to their query string keys.
+        """
+        paginator = self.paginator
+        if not self.multi_page or (self.show_all and self.can_show_all) \
+                or paginator.seek_fields is None:
+            return {}
+        # The rows are already fetched when the page links are rendered
+        rows = list(self.result_list)
+        if not rows:
+            return {}
+        keys = {self.page_num + 1: (AFTER_VAR, paginator.dump_key(rows[-1]))}
+        if self.page_num > 1:
+            keys[self.page_num - 1] = (BEFORE_VAR,
+                                       paginator.dump_key(rows[0]))
+        return keys
+
+    def get_query_string(self, new_params=None, remove=None):
+        new_params = dict(new_params or {})
+        key = self.page_keys.get(new_params.get(PAGE_VAR))
+        if key is not None:
+            new_params[key[0]] = key[1]
+        return super(KeysetChangeList, self).get_query_string(new_params,
+                                                              remove)
+
+
+class KeysetAdmin(admin.ModelAdmin):
+    """
+    Admin of a large table: estimated counts and keyset paging.
+    """
+    paginator = KeysetPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        return self.paginator(queryset, per_page, orphans,
+                              allow_empty_first_page,
+                              after=request.GET.get(AFTER_VAR),
+                              before=request.GET.get(BEFORE_VAR))
+
+
+class CustomerAdmin(KeysetAdmin):
     readonly_fields = ('utm_link',)
     list_display = ('when_created', 'card_name', 'last_name',
                     'first_name', 'middle_name', 'email', 'phone', 'ins_end',
                     'email_status', 'utm_link')
     list_filter = (HasCardFilter, 'email_status', 'when_created', 'ins_end')
+    ordering = ('-when_created', '-id')
+    # Names of the export URLs and files
+    export_name = 'customers'
+
+    def get_export_urls(self):
+        return [url(r'^export/(?P<fmt>[\w.]+)/job/$',
+                    self.admin_site.admin_view(self.export_job),
+                    name='export_%s_job' % self.export_name),
+                url(r'^export/(?P<fmt>[\w.]+)/$',
+                    self.admin_site.admin_view(self.export),
+                    name='export_%s' % self.export_name)]
 
     def get_urls(self):
         urls = super(CustomerAdmin, self).get_urls()
-        return [url(r'^export/(?P<fmt>\w+)/$',
-                    self.admin_site.admin_view(self.export),
-                    name='export_customers'),
-                url('^import/xlsx/$',
-                    self.admin_site.admin_view(ImportView.as_view()),
-                    name='import_customers'),
-                url('^clean/$',
-                    self.admin_site.admin_view(CleanView.as_view()),
-                    name='clean_customers')] + urls
+        return self.get_export_urls() + [
+            url('^import/xlsx/$',
+                self.admin_site.admin_view(ImportView.as_view()),
+                name='import_customers'),
+            url('^clean/$',
+                self.admin_site.admin_view(CleanView.as_view()),
+                name='clean_customers')
+        ] + urls
 
     def card_name(self, obj):
         return obj.get_card_name()
     card_name.short_description = 'Карта'
 
-    def export(self, request, fmt):
+    def get_export_queryset(self, request):
+        """
+        Customers shown by the changelist with the filters of ``request``.
+        """
         list_display = self.get_list_display(request)
         list_display_links = self.get_list_display_links(request, list_display)
         list_filter = self.get_list_filter(request)
@@ -91,31 +176,192 @@ class CustomerAdmin(admin.ModelAdmin):
         list_select_related = self.get_list_select_related(request)
 
         ChangeList = self.get_changelist(request)
+        cl = ChangeList(
+            request, self.model, list_display,
+            list_display_links, list_filter, self.date_hierarchy,
+            search_fields, list_select_related, self.list_per_page,
+            self.list_max_show_all, self.list_editable, self,
+        )
+        return cl.get_queryset(request)
+
+    def export(self, request, fmt):
         try:
-            cl = ChangeList(
-                request, self.model, list_display,
-                list_display_links, list_filter, self.date_hierarchy,
-                search_fields, list_select_related, self.list_per_page,
-                self.list_max_show_all, self.list_editable, self,
-            )
+            qs = self.get_export_queryset(request)
         except IncorrectLookupParameters:
             return HttpResponseBadRequest('Incorrect lookup parameters')
 
-        qs = cl.get_queryset(request)
         try:
             fmtr = export.get_formatter(fmt)
         except ValueError, e:
             raise Http404
 
-        response = HttpResponse(content_type=fmtr.content_type,
-                                content=fmtr(qs.iterator()))
+        if fmtr.streaming:
+            response = StreamingHttpResponse(fmtr.stream(export.select(qs)),
+                                             content_type=fmtr.content_type)
+        else:
+            response = HttpResponse(content_type=fmtr.content_type,
+                                    content=fmtr(qs.iterator()))
         now = timezone.now().strftime('%Y_%m_%d_%H_%M')
-        cdisp = 'attachment; filename="customers_%s.%s' % (now, fmt)
+        cdisp = 'attachment; filename="%s_%s.%s"' % (self.export_name, now,
+                                                     fmt)
         response['Content-Disposition'] = cdisp
         return response
+
+    def export_job(self, request, fmt):
+        try:
+            export.get_formatter(fmt)
+        except ValueError, e:
+            raise Http404
+        ExportJob.objects.create(user=request.user, fmt=fmt,
+                                 archive=self.model is CustomerArchive,
+                                 params=request.GET.urlencode())
+        self.message_user(request, 'Экспорт поставлен в очередь')
+        return HttpResponseRedirect(
+            reverse('admin:content_exportjob_changelist')
+        )
 admin.site.register(Customer, CustomerAdmin)
 
 
-class EmailTaskAdmin(admin.ModelAdmin):
-    list_display = ('when_created', 'when_sent', 'when_opened', 'customer')
+class CustomerArchiveAdmin(CustomerAdmin):
+    list_display = ('when_created', 'card_name', 'last_name',
+                    'first_name', 'middle_name', 'email', 'phone', 'ins_end',
+                    'email_status', 'when_archived')
+    list_filter = (HasCardFilter, 'email_status', 'when_created',
+                   'when_archived')
+    search_fields = ('=email', '=phone', '^last_name')
+    readonly_fields = ('source_id', 'when_created', 'first_name',
+                       'middle_name', 'last_name', 'email', 'phone', 'ins_end',
+                       'card', 'email_status', 'utm_link', 'when_archived')
+    export_name = 'archive'
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_search_results(self, request, queryset, search_term):
+        found, use_distinct = super(CustomerArchiveAdmin, self) \
+            .get_search_results(request, queryset, search_term)
+        # A card is searched by its number with or without the letters
+        number = search_term.strip().rpartition(' ')[2]
+        if number.isdigit():
+            found |= queryset.filter(card=int(number))
+        return found, use_distinct
+
+    def get_urls(self):
+        return self.get_export_urls() \
+            + super(CustomerAdmin, self).get_urls()
+admin.site.register(CustomerArchive, CustomerArchiveAdmin)
+
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('when_created', 'user', 'fmt', 'status', 'rows_total',
+                    'progress', 'download_link')
+    list_filter = ('status',)
+    readonly_fields = ('user', 'fmt', 'archive', 'params', 'status',
+                       'rows_total', 'rows_done', 'error', 'when_started',
+                       'when_finished', 'download_link')
+    exclude = ('filename',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        urls = super(ExportJobAdmin, self).get_urls()
+        return [url(r'^(?P<pk>\d+)/download/$',
+                    self.admin_site.admin_view(self.download),
+                    name='download_export')] + urls
+
+    def progress(self, obj):
+        return obj.get_progress()
+    progress.short_description = 'Прогресс'
+
+    def download_link(self, obj):
+        if obj.status != JobStatus.DONE:
+            return ''
+        return format_html('<a href="{0}">{1}</a>',
+                           reverse('admin:download_export', args=(obj.pk,)),
+                           obj.filename)
+    download_link.short_description = 'Файл'
+
+    def download(self, request, pk):
+        job = get_object_or_404(ExportJob, pk=pk, status=JobStatus.DONE)
+        path = job.get_path()
+        if not os.path.exists(path):
+            raise Http404
+        fmtr = export.get_formatter(job.fmt)
+        response = FileResponse(open(path, 'rb'),
+                                content_type=fmtr.content_type)
+        response['Content-Length'] = os.path.getsize(path)
+        cdisp = 'attachment; filename="%s"' % job.filename
+        response['Content-Disposition'] = cdisp
+        return response
+admin.site.register(ExportJob, ExportJobAdmin)
+
+
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('when_created', 'user', 'fmt', 'upsert', 'status',
+                    'rows_parsed', 'rows_validated', 'rows_written',
+                    'progress')
+    list_filter = ('status',)
+    readonly_fields = ('user', 'fmt', 'upsert', 'status', 'rows_parsed',
+                       'rows_validated', 'rows_written', 'rows_total',
+                       'error', 'report', 'when_started', 'when_finished')
+    exclude = ('filename', 'rows_done')
+    actions = ('retry',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry(self, request, queryset):
+        # Files are removed once imported or rejected
+        ids = [job.pk for job in queryset.filter(status=JobStatus.FAILED)
+               .exclude(filename='') if os.path.exists(job.get_path())]
+        count = ImportJob.objects.filter(pk__in=ids).update(
+            status=JobStatus.PENDING, rows_total=None, rows_done=0,
+            rows_parsed=0, rows_validated=0, error='', report='',
+            when_started=None, when_finished=None
+        )
+        self.message_user(request, 'Поставлено в очередь: %d' % count)
+    retry.short_description = 'Повторить прерванный импорт'
+
+    def rows_written(self, obj):
+        return obj.rows_done
+    rows_written.short_description = 'Записано строк'
+
+    def progress(self, obj):
+        return obj.get_progress()
+    progress.short_description = 'Прогресс записи'
+admin.site.register(ImportJob, ImportJobAdmin)
+
+
+class PurgeJobAdmin(admin.ModelAdmin):
+    list_display = ('when_created', 'user', 'archive', 'status', 'rows_total',
+                    'progress')
+    list_filter = ('status',)
+    readonly_fields = ('user', 'archive', 'status', 'rows_total', 'rows_done',
+                       'error', 'report', 'when_started', 'when_finished')
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress(self, obj):
+        return obj.get_progress()
+    progress.short_description = 'Прогресс'
+admin.site.register(PurgeJob, PurgeJobAdmin)
+
+
+class EmailTaskAdmin(KeysetAdmin):
+    list_display = ('when_created', 'when_sent', 'when_opened', 'customer',
+                    'error')
+    list_select_related = ('customer',)
 admin.site.register(EmailTask, EmailTaskAdmin)
+
+
+class EmailTaskArchiveAdmin(KeysetAdmin):
+    list_display = ('when_created', 'when_sent', 'when_opened', 'customer')
+    list_select_related = ('customer',)
+    readonly_fields = ('customer', 'when_created', 'when_sent', 'when_opened',
+                       'token', 'attempts')
+
+    def has_add_permission(self, request):
+        return False
+admin.site.register(EmailTaskArchive, EmailTaskArchiveAdmin)
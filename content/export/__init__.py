@@ -1,13 +1,65 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import csv
+import re
+import time
+import struct
+import zlib
 from cStringIO import StringIO
+from datetime import date, datetime
+from decimal import Decimal
+from tempfile import TemporaryFile
+from xml.sax.saxutils import escape
 
-from openpyxl import Workbook
+from django.utils import timezone
+
+from content.paginator import get_seek_fields, seek
+
+
+def get_key(qs, names):
+    """
+    Returns a function reading values of fields ``names`` of an item of
+    ``qs``: a model instance or a values_list() tuple.
+    """
+    fields = getattr(qs, '_fields', None)
+    if not fields:
+        return lambda obj: tuple(getattr(obj, name) for name in names)
+    pk_name = qs.model._meta.pk.name
+    fields = ['pk' if name == pk_name else name for name in fields]
+    positions = [fields.index(name) for name in names]
+    return lambda row: tuple(row[i] for i in positions)
+
+
+def iterate(qs, chunk_size=2000):
+    """
+    Yields objects of a queryset ordered by fields ending with the primary
+    key, fetching ``chunk_size`` rows per query so memory does not grow
+    with the table (MySQLdb reads whole result sets even for
+    ``iterator()``). Other orderings, and values_list() querysets without
+    the ordering fields, fall back to ``iterator()``.
+    """
+    seek_fields = get_seek_fields(qs)
+    try:
+        key = seek_fields and get_key(qs, seek_fields[0])
+    except ValueError:
+        key = None
+    if not key:
+        for obj in qs.iterator():
+            yield obj
+        return
+    names, descending = seek_fields
+    chunk = list(qs[:chunk_size])
+    while chunk:
+        for obj in chunk:
+            yield obj
+        if len(chunk) < chunk_size:
+            break
+        chunk = list(seek(qs, names, descending, key(chunk[-1]))[:chunk_size])
 
 
 class Formatter(object):
     content_type = None
+    streaming = False
 
     def __init__(self):
         if self.content_type is None:
@@ -17,29 +69,362 @@ class Formatter(object):
     def format(self, items):
         raise NotImplementedError
 
+    def stream(self, *args, **kwargs):
+        yield self.format(*args, **kwargs)
+
+    def write(self, items, fileobj, **kwargs):
+        for chunk in self.stream(items, **kwargs):
+            fileobj.write(chunk)
+
     def __call__(self, *args, **kwargs):
         return self.format(*args, **kwargs)
 
 
+def dos_datetime():
+    t = time.localtime()
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+class ZipStream(object):
+    """
+    Writes a zip archive as a stream of pieces without seeking: ``entry``
+    deflates the data of a file as it is produced and puts its sizes and
+    CRC into a data descriptor after it, ``end`` writes the central
+    directory. With ``zip64`` the sizes are not limited: every entry has
+    ZIP64 sizes and offsets, the ZIP64 end records are added if the
+    archive outgrows ``zip64_limit``. Without it the archive is plain and
+    raises ValueError over 4 GiB.
+    """
+    zip64_limit = 0xffffffff
+
+    def __init__(self, zip64=True, level=6):
+        self.zip64 = zip64
+        self.level = level
+        self.offset = 0
+        self.central = []
+        self.dos_time, self.dos_date = dos_datetime()
+
+    def _check(self, *sizes):
+        if not self.zip64 and max(sizes) > 0xffffffff:
+            raise ValueError('Zip archive over 4 GiB')
+
+    def entry(self, arcname, chunks):
+        """
+        Yields the file ``arcname`` with the data of ``chunks``.
+        """
+        name = arcname.encode('utf-8')
+        header_offset = self.offset
+        # Bit 3: sizes in the data descriptor, bit 11: UTF-8 file name
+        flags = 0x08 | 0x800
+        if self.zip64:
+            # The ZIP64 extra field makes the data descriptor sizes 8 bytes
+            extra = struct.pack(b'<2H2Q', 1, 16, 0, 0)
+            header = struct.pack(b'<4s5H3L2H', b'PK\x03\x04', 45, flags, 8,
+                                 self.dos_time, self.dos_date, 0, 0xffffffff,
+                                 0xffffffff, len(name), len(extra))
+        else:
+            extra = b''
+            header = struct.pack(b'<4s5H3L2H', b'PK\x03\x04', 20, flags, 8,
+                                 self.dos_time, self.dos_date, 0, 0, 0,
+                                 len(name), 0)
+        header += name + extra
+        yield header
+
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      -zlib.MAX_WBITS)
+        crc = size = compressed = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data = compressor.compress(chunk)
+            if data:
+                compressed += len(data)
+                yield data
+        data = compressor.flush()
+        compressed += len(data)
+        crc &= 0xffffffff
+        self._check(size, compressed)
+
+        if self.zip64:
+            descriptor = struct.pack(b'<4sL2Q', b'PK\x07\x08', crc,
+                                     compressed, size)
+            # Sizes and offset in the ZIP64 extra field
+            extra = struct.pack(b'<2H3Q', 1, 24, size, compressed,
+                                header_offset)
+            central = struct.pack(b'<4s6H3L5H2L', b'PK\x01\x02', 45, 45,
+                                  flags, 8, self.dos_time, self.dos_date, crc,
+                                  0xffffffff, 0xffffffff, len(name),
+                                  len(extra), 0, 0, 0, 0, 0xffffffff)
+        else:
+            descriptor = struct.pack(b'<4s3L', b'PK\x07\x08', crc,
+                                     compressed, size)
+            central = struct.pack(b'<4s6H3L5H2L', b'PK\x01\x02', 20, 20,
+                                  flags, 8, self.dos_time, self.dos_date, crc,
+                                  compressed, size, len(name), 0, 0, 0, 0, 0,
+                                  header_offset)
+        self.central.append(central + name + extra)
+        self.offset += len(header) + compressed + len(descriptor)
+        self._check(self.offset)
+        yield data + descriptor
+
+    def end(self):
+        """
+        Returns the central directory and the end records.
+        """
+        central = b''.join(self.central)
+        count, offset = len(self.central), self.offset
+        self._check(offset + len(central))
+        end = b''
+        if self.zip64 and offset >= self.zip64_limit:
+            # ZIP64 end of central directory record and its locator
+            end = struct.pack(b'<4sQ2H2L4Q', b'PK\x06\x06', 44, 45, 45, 0, 0,
+                              count, count, len(central), offset)
+            end += struct.pack(b'<4sLQL', b'PK\x06\x07', 0,
+                               offset + len(central), 1)
+            offset = 0xffffffff
+        end += struct.pack(b'<4s4H2LH', b'PK\x05\x06', 0, 0, count, count,
+                           len(central), offset, 0)
+        return central + end
+
+
+class SharedStrings(object):
+    """
+    Shared string table of a workbook kept in a temporary file. Strings are
+    not deduplicated, so nothing grows in memory; openpyxl 2.3 does not
+    read inline strings in read-only mode, which rules those out.
+    """
+    def __init__(self):
+        self.file = TemporaryFile()
+        self.count = 0
+
+    def add(self, value):
+        self.file.write(('<si><t xml:space="preserve">%s</t></si>'
+                         % value).encode('utf-8'))
+        self.count += 1
+        return self.count - 1
+
+    def stream(self, chunk_size=64 * 1024):
+        yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+               '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+               '2006/main" count="{0}" uniqueCount="{0}">'
+               .format(self.count)).encode('utf-8')
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        yield b'</sst>'
+
+    def close(self):
+        self.file.close()
+
+
 class XLSXFormatter(Formatter):
+    """
+    Streams the workbook of a single sheet. The sheet XML is written row by
+    row straight into its deflated zip entry and the strings go to
+    SharedStrings, so memory does not grow with the rows. Excel sheets are
+    limited to about a million rows, so the file stays a plain zip below
+    4 GiB.
+    """
     content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    streaming = True
+    # Rows per piece of the sheet passed to the compressor
+    chunk_rows = 500
+    sheet_title = 'Sheet'
 
-    def format(self, items):
-        wb = Workbook(write_only=True)
-        ws = wb.create_sheet()
-        for item in items:
-            ws.append(item)
+    # Cell styles of styles.xml, the formats are those of openpyxl
+    DATETIME_STYLE = 1
+    DATE_STYLE = 2
+    EPOCH = date(1899, 12, 30)
+    # Characters not allowed in XML 1.0
+    ILLEGAL_RE = re.compile(r'[\000-\010\013\014\016-\037]')
 
-        content = StringIO()
-        wb.save(filename=content)
-        return content.getvalue()
+    CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'content-types">'
+        '<Default Extension="rels" ContentType="application/'
+        'vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+        '"application/vnd.openxmlformats-officedocument.spreadsheetml.'
+        'worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '<Override PartName="/xl/sharedStrings.xml" ContentType='
+        '"application/vnd.openxmlformats-officedocument.spreadsheetml.'
+        'sharedStrings+xml"/>'
+        '</Types>'
+    )
+    RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    )
+    WORKBOOK = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+        '2006/main" xmlns:r="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships">'
+        '<sheets><sheet name="{title}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+    WORKBOOK_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '<Relationship Id="rId3" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/sharedStrings" '
+        'Target="sharedStrings.xml"/>'
+        '</Relationships>'
+    )
+    STYLES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/'
+        'spreadsheetml/2006/main">'
+        '<numFmts count="2">'
+        '<numFmt numFmtId="164" formatCode="yyyy-mm-dd h:mm:ss"/>'
+        '<numFmt numFmtId="165" formatCode="yyyy-mm-dd"/>'
+        '</numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font>'
+        '</fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/>'
+        '<diagonal/></border></borders>'
+        '<cellStyleXfs count="1">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0"/>'
+        '</cellStyleXfs>'
+        '<cellXfs count="3">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" '
+        'applyNumberFormat="1"/>'
+        '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" '
+        'applyNumberFormat="1"/>'
+        '</cellXfs>'
+        '<cellStyles count="1">'
+        '<cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    )
+    SHEET_START = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+        '2006/main"><sheetData>'
+    )
+    SHEET_END = '</sheetData></worksheet>'
+
+    def __init__(self):
+        self.columns = []
+
+    def _column(self, index):
+        """
+        Returns the letters of the column ``index`` counted from 0.
+        """
+        while len(self.columns) <= index:
+            number, letters = len(self.columns) + 1, ''
+            while number:
+                number, rest = divmod(number - 1, 26)
+                letters = chr(65 + rest) + letters
+            self.columns.append(letters)
+        return self.columns[index]
+
+    def _serial(self, value):
+        """
+        Returns the Excel serial number of a date or UTC datetime.
+        """
+        if not isinstance(value, datetime):
+            return (value - self.EPOCH).days
+        if timezone.is_aware(value):
+            value = value.astimezone(timezone.utc)
+        seconds = (value.hour * 3600 + value.minute * 60 + value.second
+                   + value.microsecond / 1e6)
+        return (value.date() - self.EPOCH).days + seconds / 86400
+
+    def _cell(self, ref, value, strings):
+        if isinstance(value, basestring):
+            index = strings.add(escape(self.ILLEGAL_RE.sub('', value)))
+            return '<c r="%s" t="s"><v>%d</v></c>' % (ref, index)
+        if isinstance(value, bool):
+            return '<c r="%s" t="b"><v>%d</v></c>' % (ref, value)
+        if isinstance(value, (int, long, Decimal)):
+            return '<c r="%s"><v>%s</v></c>' % (ref, value)
+        if isinstance(value, float):
+            return '<c r="%s"><v>%r</v></c>' % (ref, value)
+        if isinstance(value, date):
+            style = (self.DATETIME_STYLE if isinstance(value, datetime)
+                     else self.DATE_STYLE)
+            return '<c r="%s" s="%d"><v>%r</v></c>' % (ref, style,
+                                                      self._serial(value))
+        return self._cell(ref, unicode(value), strings)
+
+    def _row(self, number, item, strings):
+        cells = ''.join(self._cell('%s%d' % (self._column(i), number), value,
+                                   strings)
+                        for i, value in enumerate(item) if value is not None)
+        return '<row r="%d">%s</row>' % (number, cells)
+
+    def _sheet(self, items, strings):
+        yield self.SHEET_START.encode('utf-8')
+        rows = []
+        for number, item in enumerate(items, 1):
+            rows.append(self._row(number, item, strings))
+            if len(rows) == self.chunk_rows:
+                yield ''.join(rows).encode('utf-8')
+                rows = []
+        rows.append(self.SHEET_END)
+        yield ''.join(rows).encode('utf-8')
+
+    def stream(self, items):
+        archive = ZipStream(zip64=False)
+        parts = (
+            ('[Content_Types].xml', [self.CONTENT_TYPES]),
+            ('_rels/.rels', [self.RELS]),
+            ('xl/workbook.xml',
+             [self.WORKBOOK.format(title=escape(self.sheet_title))]),
+            ('xl/_rels/workbook.xml.rels', [self.WORKBOOK_RELS]),
+            ('xl/styles.xml', [self.STYLES]),
+        )
+        for name, chunks in parts:
+            for data in archive.entry(name, [c.encode('utf-8')
+                                             for c in chunks]):
+                yield data
+        strings = SharedStrings()
+        try:
+            for data in archive.entry('xl/worksheets/sheet1.xml',
+                                      self._sheet(items, strings)):
+                yield data
+            for data in archive.entry('xl/sharedStrings.xml',
+                                      strings.stream()):
+                yield data
+        finally:
+            strings.close()
+        yield archive.end()
+
+    def format(self, items):
+        return b''.join(self.stream(items))
 
 
 class CSVFormatter(Formatter):
     content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    streaming = True
 
-    def __init__(self, encoding='utf-8'):
+    def __init__(self, encoding='utf-8', chunk_rows=500):
         self.encoding = encoding
+        self.chunk_rows = chunk_rows
 
     def _encode(self, value):
         try:
@@ -50,15 +435,78 @@ class CSVFormatter(Formatter):
     def _encode_row(self, row):
         return [self._encode(v) for v in row]
 
-    def format(self, items, header=None):
+    def stream(self, items, header=None):
+        """
+        Yields the encoded file in pieces of ``chunk_rows`` rows.
+        """
         content = StringIO()
         writer = csv.writer(content, delimiter=str(';'))
         if header:
             writer.writerow(self._encode_row(header))
 
-        for item in items:
+        for i, item in enumerate(items, 1):
             writer.writerow(self._encode_row(item))
-        return content.getvalue()
+            if i % self.chunk_rows == 0:
+                yield content.getvalue()
+                content.seek(0)
+                content.truncate()
+        yield content.getvalue()
+
+    def format(self, items, header=None):
+        return b''.join(self.stream(items, header=header))
+
+
+class GzipFormatter(Formatter):
+    """
+    Compresses the stream of another streaming formatter to gzip as the
+    pieces are produced.
+    """
+    content_type = 'application/gzip'
+    streaming = True
+
+    def __init__(self, formatter, level=6):
+        self.formatter = formatter
+        self.level = level
+
+    def stream(self, *args, **kwargs):
+        # wbits 16 + MAX_WBITS makes zlib write the gzip header and trailer
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        for chunk in self.formatter.stream(*args, **kwargs):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def format(self, *args, **kwargs):
+        return b''.join(self.stream(*args, **kwargs))
+
+
+class ZipFormatter(Formatter):
+    """
+    Writes the stream of another streaming formatter as the single file
+    ``arcname`` of a ZIP64 zip archive (see ZipStream), compressing the
+    pieces as they are produced.
+    """
+    content_type = 'application/zip'
+    streaming = True
+    zip64_limit = ZipStream.zip64_limit
+
+    def __init__(self, formatter, arcname, level=6):
+        self.formatter = formatter
+        self.arcname = arcname
+        self.level = level
+
+    def stream(self, *args, **kwargs):
+        archive = ZipStream(level=self.level)
+        archive.zip64_limit = self.zip64_limit
+        for data in archive.entry(self.arcname,
+                                  self.formatter.stream(*args, **kwargs)):
+            yield data
+        yield archive.end()
+
+    def format(self, *args, **kwargs):
+        return b''.join(self.stream(*args, **kwargs))
 
 
 as_xlsx = XLSXFormatter()
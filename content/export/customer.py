@@ -1,42 +1,125 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
-from itertools import imap
+from datetime import timedelta
 from django.conf import settings
-from content.export import XLSXFormatter, CSVFormatter, FormatPool
+from dateutil.relativedelta import relativedelta
+from config.models import SiteConfiguration
+from content.models import EmailStatus
+from content.export import XLSXFormatter, CSVFormatter, GzipFormatter, \
+    ZipFormatter, FormatPool, iterate
 
 
-class CustomerXLSXFormatter(XLSXFormatter):
-    def _get_row(self, obj):
-        return (obj.when_created, obj.get_card_name(), obj.last_name, obj.first_name,
+CSV_HEADER = ('Название лида', 'Мобильный телефон', 'Частный e-mail',
+              'Дата окончания ОСАГО', 'Номер карты ЮА', 'Дата начала карты ЮА',
+              'Дата окончания карты ЮА', 'Источник', 'Канал')
+
+# Columns read by select(); they include the admin ordering fields
+FIELDS = ('when_created', 'card', 'last_name', 'first_name', 'middle_name',
+          'email', 'phone', 'ins_end', 'email_status', 'utm_link', 'pk')
+
+
+def select(qs, chunk_size=2000):
+    """
+    Customers of a queryset as FIELDS tuples, read in keyset chunks; the
+    formatters handle them without creating Customer instances.
+    """
+    return iterate(qs.values_list(*FIELDS), chunk_size)
+
+
+class RowContext(object):
+    """
+    Values shared by the rows of one export: card letters from a single
+    configuration read and card validity per registration date.
+    """
+    def __init__(self, conf):
+        self.conf = conf
+        self.letters = conf.card_letters
+        self.validity = {}
+
+    def card_name(self, card):
+        if card is None:
+            return ''
+        return '{0} {1}'.format(self.letters, card)
+
+    def card_valid(self, when_created):
+        # Same as Customer.card_valid_since() and card_valid_till()
+        day = when_created.date()
+        try:
+            return self.validity[day]
+        except KeyError:
+            since = day + timedelta(days=1)
+            dates = self.validity[day] = (since, since + relativedelta(months=3))
+            return dates
+
+
+class CustomerFormatterMixin(object):
+    def _get_values_row(self, row, ctx):
+        raise NotImplementedError
+
+    def _get_rows(self, items):
+        """
+        Formats Customer instances or FIELDS tuples made by select().
+        """
+        ctx = RowContext(SiteConfiguration.get_cached())
+        for item in items:
+            if isinstance(item, tuple):
+                yield self._get_values_row(item, ctx)
+            else:
+                yield self._get_row(item, ctx.conf)
+
+
+class CustomerXLSXFormatter(CustomerFormatterMixin, XLSXFormatter):
+    def _get_row(self, obj, conf=None):
+        return (obj.when_created, obj.get_card_name(conf), obj.last_name, obj.first_name,
                 obj.middle_name, obj.email, obj.phone,
                 obj.ins_end, obj.get_email_status_display(),
                 settings.DATA_SOURCE, obj.utm_link)
 
-    def format(self, items):
-        items = imap(self._get_row, items)
-        return super(CustomerXLSXFormatter, self).format(items)
+    def _get_values_row(self, row, ctx):
+        (when_created, card, last_name, first_name, middle_name, email,
+         phone, ins_end, email_status, utm_link, pk) = row
+        return (when_created, ctx.card_name(card), last_name, first_name,
+                middle_name, email, phone, ins_end,
+                EmailStatus._DISPLAY.get(email_status, email_status),
+                settings.DATA_SOURCE, utm_link)
 
+    def stream(self, items):
+        items = self._get_rows(items)
+        return super(CustomerXLSXFormatter, self).stream(items)
 
-class CustomerCSVFormatter(CSVFormatter):
+
+class CustomerCSVFormatter(CustomerFormatterMixin, CSVFormatter):
     def _format_date(self, value):
         return value.strftime('%d.%m.%Y')
 
-    def _get_row(self, obj):
+    def _get_row(self, obj, conf=None):
         return (obj.get_full_name(), obj.phone, obj.email,
-                self._format_date(obj.ins_end), obj.get_card_name(),
+                self._format_date(obj.ins_end), obj.get_card_name(conf),
                 self._format_date(obj.card_valid_since()),
                 self._format_date(obj.card_valid_till()),
                 settings.DATA_SOURCE, obj.utm_link)
 
-    def format(self, items, header=('Название лида', 'Мобильный телефон',
-                                    'Частный e-mail', 'Дата окончания ОСАГО',
-                                    'Номер карты ЮА', 'Дата начала карты ЮА',
-                                    'Дата окончания карты ЮА', 'Источник', 'Канал')):
-        items = imap(self._get_row, items)
+    def _get_values_row(self, row, ctx):
+        (when_created, card, last_name, first_name, middle_name, email,
+         phone, ins_end, email_status, utm_link, pk) = row
+        since, till = ctx.card_valid(when_created)
+        return (' '.join((last_name, first_name, middle_name)), phone, email,
+                self._format_date(ins_end), ctx.card_name(card),
+                self._format_date(since), self._format_date(till),
+                settings.DATA_SOURCE, utm_link)
+
+    def stream(self, items, header=CSV_HEADER):
+        items = self._get_rows(items)
+        return super(CustomerCSVFormatter, self).stream(items, header=header)
+
+    def format(self, items, header=CSV_HEADER):
         return super(CustomerCSVFormatter, self).format(items, header=header)
 
 
 as_xlsx = CustomerXLSXFormatter()
 as_csv = CustomerCSVFormatter()
+as_csv_gz = GzipFormatter(as_csv)
+as_csv_zip = ZipFormatter(as_csv, 'customers.csv')
 
-get_formatter = FormatPool(xlsx=as_xlsx, csv=as_csv)
+get_formatter = FormatPool(**{'xlsx': as_xlsx, 'csv': as_csv,
+                              'csv.gz': as_csv_gz, 'zip': as_csv_zip})
@@ -22,7 +22,37 @@ class CustomerForm(forms.Form):
 
 
 class ImportForm(forms.Form):
+    REPLACE = 'replace'
+    UPSERT = 'upsert'
+    MODES = (
+        (REPLACE, 'Заменить всех пользователей'),
+        (UPSERT, 'Обновить совпадающих по e-mail или телефону и добавить новых'),
+    )
+
+    FORMATS = ('xlsx', 'csv')
+
     data = forms.FileField(label='Пользователи')
+    mode = forms.ChoiceField(label='Режим', choices=MODES, initial=REPLACE,
+                             widget=forms.RadioSelect)
+    background = forms.BooleanField(label='В фоне', required=False,
+                                    initial=True)
+
+    def clean(self):
+        cleaned_data = super(ImportForm, self).clean()
+        data = cleaned_data.get('data')
+        if data is not None:
+            fmt = data.name.rpartition('.')[2].lower()
+            if fmt not in self.FORMATS:
+                self.add_error('data', 'Поддерживаются файлы xlsx и csv')
+            cleaned_data['fmt'] = fmt
+        return cleaned_data
+
+
+class PurgeForm(forms.Form):
+    archive = forms.BooleanField(label='Сохранить копию в архиве',
+                                 required=False)
+    background = forms.BooleanField(label='В фоне', required=False,
+                                    initial=True)
 
 
 class EmailTokenForm(forms.Form):
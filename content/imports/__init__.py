@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import csv
+import codecs
+import cPickle as pickle
+from itertools import chain, islice
+from tempfile import TemporaryFile
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from openpyxl import load_workbook
+
+
+class RowError(ValueError):
+    """
+    A row that cannot be imported; ``args`` are joined into the message.
+    """
+
+
+def read_xlsx(fileobj):
+    """
+    Yields rows of the active sheet as tuples of cell values without
+    loading the whole sheet.
+    """
+    wb = load_workbook(fileobj, read_only=True)
+    for row in wb.active.rows:
+        yield tuple(cell.value for cell in row)
+
+
+def read_csv(fileobj, delimiter=';'):
+    """
+    Yields rows of a CSV file as lists of byte strings, reading the file
+    line by line; decode them with decode_row().
+    """
+    lines = iter(fileobj)
+    first = next(lines, b'')
+    if first.startswith(codecs.BOM_UTF8):
+        first = first[len(codecs.BOM_UTF8):]
+    return csv.reader(chain((first,), lines), delimiter=str(delimiter))
+
+
+def decode_row(row, encoding='utf-8'):
+    try:
+        return tuple(value.decode(encoding) for value in row)
+    except UnicodeDecodeError:
+        raise RowError('Неверная кодировка, ожидается %s' % encoding)
+
+
+def dump_batches(items, fileobj, size=1000):
+    for batch in batches(items, size):
+        pickle.dump(batch, fileobj, pickle.HIGHEST_PROTOCOL)
+
+
+def load_batches(fileobj):
+    while True:
+        try:
+            batch = pickle.load(fileobj)
+        except EOFError:
+            return
+        for item in batch:
+            yield item
+
+
+def batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Importer(object):
+    """
+    Imports objects of ``model`` parsed from rows, either replacing all
+    existing objects or updating the ones matched by ``key_fields``.
+
+    The rows are read once. The first pass parses and validates them
+    against the file's own values and the stored objects of the same
+    ``unique_fields`` values, fetched ``batch_size`` rows at a time, and
+    spools the resulting inserts and updates to a temporary file. Only if
+    no row is wrong the second pass writes them in one transaction.
+    """
+    model = None
+    batch_size = 1000
+    # Only this many errors are kept, the rest are counted
+    max_errors = 100
+    # Fields identifying an existing object in the upsert mode
+    key_fields = ()
+    # Fields compared and updated in the upsert mode
+    update_fields = ()
+    # Fields that must not repeat; empty values are not checked
+    unique_fields = ()
+
+    def __init__(self, progress=None):
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        self.error_count = 0
+        # Called with the importer after every batch of every stage
+        self.progress = progress
+        self.rows_parsed = 0
+        self.rows_validated = 0
+        self.rows_to_write = 0
+        self.rows_written = 0
+
+    def read(self, fileobj):
+        """
+        Returns an iterable of rows of the uploaded file.
+        """
+        raise NotImplementedError
+
+    def parse(self, row):
+        """
+        Returns an unsaved object for ``row``, None to skip the row, or
+        raises RowError.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        self.model.objects.all().delete()
+
+    def finish(self):
+        pass
+
+    def add_error(self, number, *args):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(('Строка %d' % number,) + args)
+
+    def get_error_messages(self):
+        messages = [': '.join(unicode(arg) for arg in error)
+                    for error in self.errors]
+        more = self.error_count - len(self.errors)
+        if more > 0:
+            messages.append('И ещё ошибок: %d' % more)
+        return messages
+
+    def report(self):
+        if self.progress is not None:
+            self.progress(self)
+
+    def convert(self, number, row):
+        """
+        Returns (number, object or None, error args or None) for a row.
+        """
+        try:
+            return number, self.parse(row), None
+        except RowError as e:
+            return number, None, e.args
+
+    def convert_rows(self, fileobj):
+        """
+        Yields converted rows of the uploaded file in order.
+        """
+        for number, row in enumerate(self.read(fileobj), 1):
+            yield self.convert(number, row)
+
+    def _parse_rows(self, converted):
+        for number, obj, error in converted:
+            self.rows_parsed += 1
+            if error is not None:
+                self.add_error(number, *error)
+            elif obj is not None:
+                yield number, obj
+
+    def get_values(self, obj):
+        return {f.attname: getattr(obj, f.attname)
+                for f in self.model._meta.concrete_fields
+                if not f.primary_key}
+
+    def find_existing(self, objs, fields):
+        """
+        Returns {(field, value): values dict} of stored objects sharing a
+        value of ``fields`` with ``objs``.
+        """
+        q = Q()
+        for name in fields:
+            values = set(getattr(obj, name) for obj in objs)
+            values.discard(None)
+            if values:
+                q |= Q(**{'%s__in' % name: values})
+        if not q:
+            return {}
+        names = set(fields) | set(self.update_fields)
+        found = {}
+        for values in self.model.objects.filter(q).values('pk', *names):
+            for name in fields:
+                found[name, values[name]] = values
+        return found
+
+    def get_changes(self, obj, current):
+        changes = {}
+        for name in self.update_fields:
+            field = self.model._meta.get_field(name)
+            value = field.to_python(getattr(obj, name))
+            if value != current[name]:
+                changes[name] = value
+        return changes
+
+    def check(self, number, obj, found, index, matched):
+        """
+        Validates a parsed row, returns the stored values it updates or
+        None. ``index`` maps unique field values of the file to row
+        numbers, ``matched`` maps stored objects to the rows updating them.
+        """
+        current = None
+        for name in self.key_fields:
+            values = found.get((name, getattr(obj, name)))
+            if values is None:
+                continue
+            if current is not None and current['pk'] != values['pk']:
+                self.add_error(number, 'Совпадает с разными записями',
+                               *[getattr(obj, n) for n in self.key_fields])
+                return None
+            current = values
+
+        if current is not None:
+            first = matched.setdefault(current['pk'], number)
+            if first != number:
+                self.add_error(number, 'Совпадает с той же записью, '
+                                       'что строка %d' % first)
+
+        for name in self.unique_fields:
+            value = getattr(obj, name)
+            if value is None or value == '':
+                continue
+            first = index[name].setdefault(value, number)
+            if first != number:
+                self.add_error(number, 'Повторяется в строке %d' % first,
+                               value)
+            other = found.get((name, value))
+            if other is not None and other is not current:
+                self.add_error(number, 'Уже есть у другой записи', value)
+        return current
+
+    def prepare(self, converted, spool, upsert=False):
+        """
+        Validates converted rows and spools batches of (pk, values) pairs:
+        pk is None for new objects, otherwise values are the changed fields.
+        """
+        index = {name: {} for name in self.unique_fields}
+        matched = {}
+        fields = self.key_fields + self.unique_fields if upsert else ()
+        for batch in batches(self._parse_rows(converted), self.batch_size):
+            self.report()
+            found = self.find_existing([obj for n, obj in batch], fields)
+            ops = []
+            for number, obj in batch:
+                current = self.check(number, obj, found, index, matched)
+                if current is None:
+                    ops.append((None, self.get_values(obj)))
+                else:
+                    changes = self.get_changes(obj, current)
+                    if changes:
+                        ops.append((current['pk'], changes))
+            if not self.error_count:
+                pickle.dump(ops, spool, pickle.HIGHEST_PROTOCOL)
+                self.rows_to_write += len(ops)
+            self.rows_validated = self.rows_parsed
+            self.report()
+
+    def write(self, spool):
+        while True:
+            try:
+                ops = pickle.load(spool)
+            except EOFError:
+                break
+            new = []
+            for pk, values in ops:
+                if pk is None:
+                    new.append(self.model(**values))
+                else:
+                    self.model.objects.filter(pk=pk).update(**values)
+                    self.updated += 1
+            self.model.objects.bulk_create(new)
+            self.created += len(new)
+            self.rows_written += len(ops)
+            self.report()
+
+    def run(self, fileobj, upsert=False):
+        """
+        Imports the uploaded file, returns the list of errors.
+        """
+        spool = TemporaryFile()
+        try:
+            self.prepare(self.convert_rows(fileobj), spool, upsert)
+            if self.error_count:
+                return self.errors
+            spool.seek(0)
+            with transaction.atomic():
+                if not upsert:
+                    self.clear()
+                self.write(spool)
+                self.finish()
+        except IntegrityError as e:
+            self.created = self.updated = 0
+            self.errors.append(('Ошибка записи', unicode(e)))
+            self.error_count += 1
+        finally:
+            spool.close()
+        return self.errors
+
+
+class XLSXImporter(Importer):
+    """
+    Reads the active sheet of an xlsx file.
+    """
+    def read(self, fileobj):
+        return read_xlsx(fileobj)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import re
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from content.models import Customer, CustomerArchive, EmailStatus, \
+    FreeCard
+from content.export import FormatPool
+from content.export.customer import CSV_HEADER
+from content.purge import Purger
+from content.imports import Importer, XLSXImporter, RowError, read_csv, \
+    decode_row
+
+
+# Columns of CustomerXLSXFormatter
+XLSX_COLUMNS = ('when_created', 'card', 'last_name', 'first_name',
+                'middle_name', 'email', 'phone', 'ins_end', 'email_status',
+                'source', 'utm_link')
+
+CARD_RE = re.compile(r'.*?(\d+)$')
+
+TEXT_FIELDS = ('last_name', 'first_name', 'middle_name', 'email', 'phone',
+               'utm_link')
+
+
+class CustomerImporter(Importer):
+    model = Customer
+    key_fields = ('email', 'phone')
+    # The registration date of a stored customer is kept
+    update_fields = ('card', 'last_name', 'first_name', 'middle_name',
+                     'email', 'phone', 'ins_end', 'email_status', 'utm_link')
+    unique_fields = ('email', 'phone', 'card')
+
+    def __init__(self, progress=None):
+        super(CustomerImporter, self).__init__(progress)
+        self.statuses = {v: k for k, v in EmailStatus._DISPLAY.iteritems()}
+
+    def parse_card(self, value):
+        if not value:
+            return None
+        m = CARD_RE.match(unicode(value))
+        if m is None:
+            raise RowError('Неправильный формат карты', value)
+        return int(m.group(1))
+
+    def parse_when_created(self, value):
+        # Rows without the date are registered now, as by the landing
+        if value is None:
+            return timezone.now()
+        if not isinstance(value, datetime):
+            raise RowError('Неверная дата регистрации', value)
+        if timezone.is_naive(value):
+            # Exported dates are in UTC
+            value = timezone.make_aware(value, timezone.utc)
+        return value
+
+    def parse_status(self, value):
+        try:
+            return self.statuses[value]
+        except KeyError:
+            raise RowError('Неверно указан статус письма', value)
+
+    def find_existing(self, objs, fields):
+        found = super(CustomerImporter, self).find_existing(objs, fields)
+        # Cards of archived customers are never issued again
+        cards = set(obj.card for obj in objs)
+        cards.discard(None)
+        self.archived_cards = set(
+            CustomerArchive.objects.filter(card__in=cards)
+            .values_list('card', flat=True)
+        ) if cards else set()
+        return found
+
+    def check(self, number, obj, found, index, matched):
+        current = super(CustomerImporter, self).check(number, obj, found,
+                                                      index, matched)
+        if obj.card in self.archived_cards \
+                and (current is None or current.get('card') != obj.card):
+            self.add_error(number, 'Карта выдана архивному пользователю',
+                           obj.card)
+        return current
+
+    def clear(self):
+        # Runs inside the import transaction, which TRUNCATE would commit;
+        # finish() rebuilds the card pool
+        Purger(allow_truncate=False).purge()
+
+    def finish(self):
+        FreeCard.objects.rebuild()
+
+
+class CustomerXLSXImporter(XLSXImporter, CustomerImporter):
+    def parse(self, row):
+        if len(row) <= XLSX_COLUMNS.index('email_status'):
+            raise RowError('Не указан статус письма')
+        if len(row) < len(XLSX_COLUMNS):
+            raise RowError('Не хватает столбцов', len(row))
+        c = dict(zip(XLSX_COLUMNS, row))
+        del c['source']
+        for name in TEXT_FIELDS:
+            # Empty cells are read as None
+            if c[name] is None:
+                c[name] = ''
+        c['when_created'] = self.parse_when_created(c['when_created'])
+        c['card'] = self.parse_card(c['card'])
+        c['email_status'] = self.parse_status(c['email_status'])
+        return Customer(**c)
+
+
+class CustomerCSVImporter(CustomerImporter):
+    """
+    Reads files of CustomerCSVFormatter. They have no email status, so new
+    customers get NOT_EXIST and stored ones keep theirs. The registration
+    date of new customers is restored from the first day of card validity
+    (see Customer.card_valid_since), its time is lost.
+    """
+    update_fields = ('card', 'last_name', 'first_name', 'middle_name',
+                     'email', 'phone', 'ins_end', 'utm_link')
+
+    def read(self, fileobj):
+        return read_csv(fileobj)
+
+    def parse_date(self, value):
+        try:
+            return datetime.strptime(value, '%d.%m.%Y').date()
+        except ValueError:
+            raise RowError('Неверная дата', value)
+
+    def parse_since(self, value):
+        if not value:
+            return self.parse_when_created(None)
+        day = self.parse_date(value) - timedelta(days=1)
+        return datetime.combine(day, time()).replace(tzinfo=timezone.utc)
+
+    def parse(self, row):
+        row = decode_row(row)
+        if row == CSV_HEADER:
+            return None
+        if len(row) < len(CSV_HEADER):
+            raise RowError('Не хватает столбцов', len(row))
+        (full_name, phone, email, ins_end, card,
+         since, till, source, utm_link) = row[:len(CSV_HEADER)]
+        names = full_name.split(' ', 2)
+        if len(names) < 3:
+            raise RowError('Неполное ФИО', full_name)
+        last_name, first_name, middle_name = names
+        return Customer(when_created=self.parse_since(since),
+                        last_name=last_name, first_name=first_name,
+                        middle_name=middle_name, email=email, phone=phone,
+                        ins_end=self.parse_date(ins_end),
+                        card=self.parse_card(card), utm_link=utm_link,
+                        email_status=EmailStatus.NOT_EXIST)
+
+
+get_importer = FormatPool(xlsx=CustomerXLSXImporter, csv=CustomerCSVImporter)
+
+
+def import_file(fileobj, fmt, upsert=False):
+    """
+    Imports customers from an uploaded file, returns the importer and
+    errors.
+    """
+    importer = get_importer(fmt)()
+    errors = importer.run(fileobj, upsert=upsert)
+    return importer, errors
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import os
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin
+from django.db import connections, transaction
+from django.db.utils import load_backend
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+
+from content.export import customer as export
+from content.imports.customer import get_importer
+from content.models import Customer, CustomerArchive, ExportJob, ImportJob, \
+    PurgeJob, JobStatus
+from content.purge import Purger
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner(object):
+    """
+    Takes pending jobs of ``model`` one by one, stores their progress and
+    result on the job row.
+    """
+    model = None
+    progress_every = 1000
+    _progress_connection = None
+
+    def claim(self):
+        with transaction.atomic():
+            job = self.model.objects.select_for_update() \
+                .filter(status=JobStatus.PENDING).order_by('id').first()
+            if job is None:
+                return None
+            job.status = JobStatus.RUNNING
+            job.when_started = timezone.now()
+            job.save(update_fields=['status', 'when_started'])
+        return job
+
+    def get_progress_connection(self):
+        """
+        Returns a connection of its own to the database of the jobs, or
+        None on SQLite, which has one writer at a time.
+        """
+        connection = connections[self.model.objects.db]
+        if connection.vendor == 'sqlite':
+            return None
+        if self._progress_connection is None:
+            backend = load_backend(connection.settings_dict['ENGINE'])
+            self._progress_connection = backend.DatabaseWrapper(
+                connection.settings_dict, connection.alias
+            )
+        return self._progress_connection
+
+    def update_committed(self, job, connection, fields):
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        names = sorted(fields)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE %s SET %s WHERE %s = %%s' % (
+                    qn(opts.db_table),
+                    ', '.join('%s = %%s' % qn(opts.get_field(name).column)
+                              for name in names),
+                    qn(opts.pk.column),
+                ),
+                [opts.get_field(name).get_db_prep_save(fields[name],
+                                                       connection)
+                 for name in names] + [job.pk]
+            )
+
+    def update(self, job, **fields):
+        """
+        Saves ``fields`` of the job. Inside a transaction of the job's work
+        they are saved by the progress connection, so they are seen at once
+        rather than when the work commits.
+        """
+        progress = None
+        if transaction.get_connection(self.model.objects.db).in_atomic_block:
+            progress = self.get_progress_connection()
+        if progress is None:
+            self.model.objects.filter(pk=job.pk).update(**fields)
+        else:
+            self.update_committed(job, progress, fields)
+        for name, value in fields.iteritems():
+            setattr(job, name, value)
+
+    def track(self, job, items):
+        """
+        Passes ``items`` through, saving the number of items seen.
+        """
+        done = 0
+        for done, item in enumerate(items, 1):
+            yield item
+            if done % self.progress_every == 0:
+                self.update(job, rows_done=done)
+        self.update(job, rows_done=done)
+
+    def run(self, job):
+        raise NotImplementedError
+
+    def process(self):
+        """
+        Runs one job, returns False if there was none.
+        """
+        job = self.claim()
+        if job is None:
+            return False
+        try:
+            self.run(job)
+        except Exception as e:
+            logger.exception('%s %s failed', self.model.__name__, job.pk)
+            self.update(job, status=JobStatus.FAILED, error=unicode(e),
+                        when_finished=timezone.now())
+        else:
+            self.update(job, status=JobStatus.DONE,
+                        when_finished=timezone.now())
+        finally:
+            if self._progress_connection is not None:
+                self._progress_connection.close()
+        return True
+
+    def cleanup(self):
+        pass
+
+
+class ExportRunner(JobRunner):
+    model = ExportJob
+
+    def get_model_admin(self, job):
+        return admin.site._registry[CustomerArchive if job.archive
+                                    else Customer]
+
+    def get_queryset(self, job):
+        request = HttpRequest()
+        request.GET = QueryDict(job.params)
+        request.user = job.user
+        return self.get_model_admin(job).get_export_queryset(request)
+
+    def run(self, job):
+        fmtr = export.get_formatter(job.fmt)
+        qs = self.get_queryset(job)
+        self.update(job, rows_total=qs.count())
+
+        if not os.path.isdir(settings.EXPORT_ROOT):
+            os.makedirs(settings.EXPORT_ROOT)
+        now = timezone.now().strftime('%Y_%m_%d_%H_%M')
+        filename = '%s_%s_%d.%s' % (self.get_model_admin(job).export_name,
+                                    now, job.pk, job.fmt)
+        self.update(job, filename=filename)
+        with open(job.get_path(), 'wb') as f:
+            fmtr.write(self.track(job, export.select(qs)), f)
+
+    def cleanup(self):
+        """
+        Removes finished jobs older than EXPORT_RETENTION_DAYS with files.
+        """
+        days = settings.EXPORT_RETENTION_DAYS
+        jobs = self.model.objects.filter(
+            status__in=(JobStatus.DONE, JobStatus.FAILED),
+            when_created__lt=timezone.now() - timedelta(days=days)
+        )
+        for job in jobs:
+            if job.filename and os.path.exists(job.get_path()):
+                os.remove(job.get_path())
+            job.delete()
+
+
+class ImportRunner(JobRunner):
+    model = ImportJob
+
+    def track_import(self, job, importer):
+        self.update(job, rows_parsed=importer.rows_parsed,
+                    rows_validated=importer.rows_validated,
+                    rows_total=importer.rows_to_write,
+                    rows_done=importer.rows_written)
+
+    def run(self, job):
+        """
+        Imports the uploaded file. It is kept if the run breaks off, so the
+        job can be retried, and removed once the file is imported or
+        rejected.
+        """
+        importer = get_importer(job.fmt)(
+            progress=lambda importer: self.track_import(job, importer)
+        )
+        with open(job.get_path(), 'rb') as f:
+            errors = importer.run(f, upsert=job.upsert)
+        os.remove(job.get_path())
+        if errors:
+            self.update(job, report='\n'.join(importer.get_error_messages()))
+            raise ValueError('Ошибок: %d' % importer.error_count)
+        self.update(job, report='Добавлено: %d, обновлено: %d'
+                                % (importer.created, importer.updated))
+
+    def cleanup(self):
+        """
+        Removes files of failed jobs older than IMPORT_RETENTION_DAYS.
+        """
+        days = settings.IMPORT_RETENTION_DAYS
+        jobs = self.model.objects.filter(
+            status=JobStatus.FAILED,
+            when_created__lt=timezone.now() - timedelta(days=days)
+        ).exclude(filename='')
+        for job in jobs:
+            if os.path.exists(job.get_path()):
+                os.remove(job.get_path())
+            self.update(job, filename='')
+
+
+class PurgeRunner(JobRunner):
+    model = PurgeJob
+
+    def run(self, job):
+        purger = Purger(
+            archive=job.archive,
+            progress=lambda purger: self.update(job,
+                                                rows_total=purger.rows_total,
+                                                rows_done=purger.rows_done)
+        )
+        purger.run()
+        self.update(job, report=purger.get_report())
+
+
+runners = [ExportRunner(), ImportRunner(), PurgeRunner()]
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+import os
+import threading
+from Queue import Queue, Empty
+from datetime import timedelta
+from email.mime.image import MIMEImage
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.mail import get_connection
+from django.core.mail.message import EmailMultiAlternatives
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.template import loader
+from django.utils.encoding import force_text
+from django.utils import timezone
+
+from config.models import SiteConfiguration
+from content.models import Customer, EmailStatus, EmailTask, Text
+
+
+logger = logging.getLogger(__name__)
+
+
+class EmailAssets(object):
+    """
+    The email template and its inline images (settings.EMAIL_IMAGES), loaded
+    once per process. Image parts are encoded once and shared by all
+    messages; they are loaded again when the modification time of a file
+    changes, which is checked on every call, so new images are picked up
+    after collectstatic without a restart. The template is cached by the
+    template loaders as any other.
+    """
+    template_name = 'email_card.html'
+
+    def __init__(self):
+        self._template = None
+        self._images = None
+        # (file name, modification time) of the loaded images
+        self._stamps = ()
+
+    def get_template(self):
+        if self._template is None:
+            self._template = loader.get_template(self.template_name)
+        return self._template
+
+    def load_images(self):
+        images, stamps = [], []
+        for cid, path in settings.EMAIL_IMAGES:
+            filename = finders.find(path)
+            if filename is None:
+                raise ValueError('Email image not found: %s' % path)
+            stamps.append((filename, os.path.getmtime(filename)))
+            with open(filename, 'rb') as f:
+                img = MIMEImage(f.read())
+            img.add_header('Content-ID', '<%s>' % cid)
+            images.append(img)
+        self._images, self._stamps = images, stamps
+
+    def images_changed(self):
+        try:
+            return any(os.path.getmtime(filename) != mtime
+                       for filename, mtime in self._stamps)
+        except OSError:
+            return True
+
+    def get_images(self):
+        if self._images is None or self.images_changed():
+            self.load_images()
+        return self._images
+
+    def clear(self):
+        self._template = None
+        self._images = None
+        self._stamps = ()
+
+
+email_assets = EmailAssets()
+
+
+@receiver(setting_changed)
+def on_setting_changed(sender, setting, **kwargs):
+    if setting in ('EMAIL_IMAGES', 'TEMPLATES'):
+        email_assets.clear()
+
+
+def build_message(task, text, conf):
+    ctx = text.get_template_context(task.customer, conf)
+    ctx['msg'] = text.render(data=ctx)
+    ctx['token'] = task.token
+    ctx['site_url'] = settings.SITE_URL
+    body = email_assets.get_template().render(ctx)
+    msg = EmailMultiAlternatives(subject=conf.email_subject,
+                                 body=body, to=[task.customer.email],
+                                 from_email=settings.DEFAULT_FROM_EMAIL)
+    msg.attach_alternative(body, 'text/html')
+    for img in email_assets.get_images():
+        msg.attach(img)
+    return msg
+
+
+class Outbox(object):
+    """
+    Sends pending EmailTask rows in batches.
+
+    Tasks are leased by pushing ``next_attempt`` forward, so several workers
+    may run at once and a task of a crashed worker is retried after
+    ``lease``. Every worker thread keeps its own SMTP connection open for
+    the whole batch.
+    """
+    def __init__(self, batch_size=100, concurrency=1, max_attempts=5,
+                 backoff=60, lease=600):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+
+    def claim(self):
+        now = timezone.now()
+        with transaction.atomic():
+            ids = list(EmailTask.objects.pending(now).select_for_update()
+                       .order_by('next_attempt', 'id')
+                       .values_list('id', flat=True)[:self.batch_size])
+            EmailTask.objects.filter(pk__in=ids).update(
+                next_attempt=now + timedelta(seconds=self.lease)
+            )
+        return list(EmailTask.objects.filter(pk__in=ids)
+                    .select_related('customer').order_by('id'))
+
+    def _send(self, queue, errors):
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+            while True:
+                try:
+                    task, msg = queue.get_nowait()
+                except Empty:
+                    break
+                try:
+                    connection.send_messages([msg])
+                except Exception as e:
+                    logger.warning('Cannot send email %s: %s', task.id, e)
+                    errors[task.id] = e
+                    connection.close()
+                    connection.open()
+        except Exception as e:
+            logger.exception('Email connection failed')
+            while True:
+                try:
+                    task, msg = queue.get_nowait()
+                except Empty:
+                    break
+                errors[task.id] = e
+        finally:
+            connection.close()
+
+    def send(self, messages):
+        """
+        Sends ``(task, message)`` pairs, returns {task id: exception} for
+        failed ones.
+        """
+        queue = Queue()
+        for item in messages:
+            queue.put(item)
+        errors = {}
+        workers = [threading.Thread(target=self._send, args=(queue, errors))
+                   for _ in xrange(min(self.concurrency, queue.qsize()))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return errors
+
+    def mark_sent(self, tasks):
+        ids = [task.id for task in tasks]
+        EmailTask.objects.filter(pk__in=ids).update(when_sent=timezone.now(),
+                                                    next_attempt=None,
+                                                    error='')
+        Customer.objects.filter(emails__in=ids) \
+            .exclude(email_status=EmailStatus.OPENED) \
+            .update(email_status=EmailStatus.SENT)
+
+    def mark_failed(self, tasks, errors):
+        """
+        Schedules a retry of ``tasks`` or gives them up after
+        ``max_attempts``; ``errors`` maps task ids to the reasons kept in
+        EmailTask.error.
+        """
+        now = timezone.now()
+        groups = {}
+        for task in tasks:
+            reason = force_text(errors[task.id], errors='replace')[:255]
+            groups.setdefault((task.attempts + 1, reason), []).append(task.id)
+        for (attempts, reason), ids in groups.iteritems():
+            if attempts >= self.max_attempts:
+                EmailTask.objects.filter(pk__in=ids).update(
+                    attempts=attempts, next_attempt=None, error=reason
+                )
+                Customer.objects.filter(emails__in=ids) \
+                    .update(email_status=EmailStatus.FAILED)
+            else:
+                delay = timedelta(seconds=self.backoff * 2 ** (attempts - 1))
+                EmailTask.objects.filter(pk__in=ids).update(
+                    attempts=attempts, next_attempt=now + delay, error=reason
+                )
+
+    def process(self):
+        """
+        Sends one batch, returns the number of tasks taken.
+
+        Without an active email text the batch counts as a failed attempt,
+        so the tasks are given up after ``max_attempts`` instead of piling
+        up and going out at once when a text is activated.
+        """
+        tasks = self.claim()
+        if not tasks:
+            return 0
+        text = Text.get_active().get(Text.PLACE.EMAIL)
+        if text is None:
+            logger.error('No active email text, %d emails are not sent',
+                         len(tasks))
+            self.mark_failed(tasks, dict.fromkeys(
+                [task.id for task in tasks], 'Нет активного текста письма'
+            ))
+            return len(tasks)
+        conf = SiteConfiguration.get_cached()
+        messages, errors = [], {}
+        for task in tasks:
+            try:
+                messages.append((task, build_message(task, text, conf)))
+            except Exception as e:
+                logger.exception('Cannot build email %s', task.id)
+                errors[task.id] = e
+        errors.update(self.send(messages))
+        self.mark_sent([task for task, msg in messages
+                        if task.id not in errors])
+        self.mark_failed([task for task in tasks if task.id in errors],
+                         errors)
+        return len(tasks)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from config.models import SiteConfiguration
+from content.models import Customer
+from content.purge import Purger
+
+
+class Command(BaseCommand):
+    help = 'Moves customers registered more than retention_months months ' \
+           'ago and their email tasks into the archive tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=None,
+                            help='Overrides retention_months of the site '
+                                 'configuration.')
+        parser.add_argument('--batch-size', type=int,
+                            default=Purger.chunk_size,
+                            help='Customers moved in one transaction.')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only count the customers to move.')
+
+    def report(self, purger):
+        self.stdout.write('Archived %d of %d'
+                          % (purger.rows_done, purger.rows_total))
+
+    def handle(self, *args, **options):
+        months = options['months']
+        if months is None:
+            months = SiteConfiguration.get_solo().retention_months
+        if not months:
+            self.stdout.write('Archiving is off')
+            return
+        since = timezone.now() - relativedelta(months=months)
+        qs = Customer.objects.filter(when_created__lt=since)
+        if options['dry_run']:
+            self.stdout.write('Customers to archive: %d' % qs.count())
+            return
+        purger = Purger(queryset=qs, archive=True, progress=self.report)
+        purger.chunk_size = options['batch_size']
+        purger.run()
+        self.stdout.write(self.style.SUCCESS('Archived: %d' % purger.rows_done))
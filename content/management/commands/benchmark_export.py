@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import time
+import resource
+from datetime import date, timedelta
+from multiprocessing import Process, Queue
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from config.models import SiteConfiguration
+from content.export import customer as export
+
+
+def get_rows(count):
+    """
+    Yields ``count`` made up customers as export.FIELDS tuples.
+    """
+    now = timezone.now()
+    for pk in xrange(1, count + 1):
+        yield (now - timedelta(minutes=pk), pk, 'Фамилия%d' % pk,
+               'Имя%d' % pk, 'Отчество', 'user%d@example.com' % pk,
+               '0%09d' % pk, date(2030, 1, 1) + timedelta(days=pk % 365),
+               pk % 4, 'http://example.com/?utm_source=%d' % pk, pk)
+
+
+def get_peak_rss():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+def measure(fmt, count, results):
+    """
+    Exports ``count`` rows to ``fmt`` in this (forked) process, puts
+    (seconds, bytes, peak RSS growth in MB) to ``results``.
+    """
+    fmtr = export.get_formatter(fmt)
+    start_rss = get_peak_rss()
+    start = time.time()
+    size = 0
+    if fmtr.streaming:
+        for chunk in fmtr.stream(get_rows(count)):
+            size += len(chunk)
+    else:
+        size = len(fmtr.format(get_rows(count)))
+    results.put((time.time() - start, size, get_peak_rss() - start_rss))
+
+
+class Command(BaseCommand):
+    help = 'Exports made up customers to each format and prints the time, ' \
+           'size and peak memory growth; nothing is read from the customers ' \
+           'table. Fails if the memory grows more than --max-rss.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, action='append',
+                            help='Number of rows, may be repeated; 10000 and '
+                                 '40000 by default.')
+        parser.add_argument('--format', action='append', dest='formats',
+                            help='Export format, may be repeated; all '
+                                 'formats by default.')
+        parser.add_argument('--max-rss', type=int, default=10,
+                            help='Allowed peak memory growth of an export '
+                                 'in MB, whatever the number of rows.')
+
+    def handle(self, *args, **options):
+        counts = options['rows'] or [10000, 40000]
+        formats = options['formats'] or ['xlsx', 'csv', 'csv.gz', 'zip']
+        for fmt in formats:
+            try:
+                export.get_formatter(fmt)
+            except ValueError as e:
+                raise CommandError(e)
+        # Loaded once here instead of in every process
+        SiteConfiguration.get_cached()
+        connections.close_all()
+
+        self.stdout.write('%-8s %8s %8s %10s %8s %8s'
+                          % ('format', 'rows', 'seconds', 'bytes', 'rows/s',
+                             'RSS MB'))
+        peak = 0
+        for fmt in formats:
+            for count in counts:
+                results = Queue()
+                process = Process(target=measure, args=(fmt, count, results))
+                process.start()
+                seconds, size, rss = results.get()
+                process.join()
+                peak = max(peak, rss)
+                self.stdout.write('%-8s %8d %8.2f %10d %8d %8d'
+                                  % (fmt, count, seconds, size,
+                                     count / max(seconds, 0.001), rss))
+        if peak > options['max_rss']:
+            raise CommandError('Peak memory grew by %d MB, over %d MB'
+                               % (peak, options['max_rss']))
+        self.stdout.write(self.style.SUCCESS(
+            'Peak memory growth: %d MB, within %d MB'
+            % (peak, options['max_rss'])
+        ))
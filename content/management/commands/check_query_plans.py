@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from content.models import Customer, EmailStatus, EmailTask
+
+
+SQLITE_INDEX_RE = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN for the admin filters and lookups and fails if ' \
+           'one of them does not use the index of its column.'
+
+    def get_checks(self):
+        """
+        Returns (description, queryset, indexed column) triples.
+        """
+        now = timezone.now()
+        today = now.date()
+        return (
+            ('Customers without a card', Customer.objects.filter(card=None),
+             'card'),
+            ('Customers by email status',
+             Customer.objects.filter(email_status=EmailStatus.SENT),
+             'email_status'),
+            ('Customers by registration date',
+             Customer.objects.filter(when_created__gte=now - timedelta(days=7),
+                                     when_created__lt=now),
+             'when_created'),
+            ('Customers by insurance end',
+             Customer.objects.filter(ins_end__gte=today,
+                                     ins_end__lt=today + timedelta(days=30)),
+             'ins_end'),
+            ('Email list', EmailTask.objects.order_by('-when_created')[:100],
+             'when_created'),
+            ('Email opened',
+             EmailTask.objects.filter(when_opened=None, token='x' * 12),
+             'token'),
+            ('Email queue', EmailTask.objects.pending(now)
+             .order_by('next_attempt', 'id'), 'next_attempt'),
+        )
+
+    def get_used_indexes(self, cursor, qs):
+        sql, params = qs.query.sql_with_params()
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [m.group(1) for row in cursor.fetchall()
+                    for m in SQLITE_INDEX_RE.finditer(row[-1])]
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            names = [col[0] for col in cursor.description]
+            return [dict(zip(names, row))['key'] for row in cursor.fetchall()]
+        raise CommandError('Unsupported database: %s' % connection.vendor)
+
+    def handle(self, *args, **options):
+        failed = 0
+        with connection.cursor() as cursor:
+            for name, qs, column in self.get_checks():
+                table = qs.model._meta.db_table
+                constraints = connection.introspection.get_constraints(cursor,
+                                                                       table)
+                used = self.get_used_indexes(cursor, qs)
+                ok = any(constraints.get(key, {}).get('columns') == [column]
+                         for key in used if key)
+                if ok:
+                    self.stdout.write('%s: %s' % (name, ', '.join(used)))
+                else:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(
+                        '%s: no index on %s.%s used' % (name, table, column)
+                    ))
+        if failed:
+            raise CommandError('%d queries do not use their indexes' % failed)
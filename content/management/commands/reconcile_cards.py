@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from content.models import Customer, FreeCard, CardStock
+
+
+class Command(BaseCommand):
+    help = 'Checks the stored number of available cards and the free card ' \
+           'pool against the customers table and fixes them if they differ.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only report the difference.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            conf = FreeCard.objects.lock_config()
+            actual = Customer.objects.count_avail_cards(conf)
+            stored = CardStock.get_solo().available
+            pooled = FreeCard.objects.count()
+            self.stdout.write('Available cards: %d; stored: %d; in pool: %d'
+                              % (actual, stored, pooled))
+            if actual == stored == pooled:
+                return
+            if options['dry_run']:
+                self.stdout.write(self.style.WARNING('Counter is out of sync'))
+                return
+            FreeCard.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            'Counter set to %d' % CardStock.get_solo().available
+        ))
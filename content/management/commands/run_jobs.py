@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import time
+
+from django.core.management.base import BaseCommand
+
+from content.jobs import runners
+
+
+class Command(BaseCommand):
+    help = 'Runs background export, import and purge jobs and removes ' \
+           'expired exports.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=5,
+                            help='Seconds to sleep when nothing is pending.')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Exit when nothing is pending.')
+
+    def handle(self, *args, **options):
+        while True:
+            busy = False
+            for runner in runners:
+                busy = runner.process() or busy
+            if busy:
+                continue
+            for runner in runners:
+                runner.cleanup()
+            if options['once']:
+                break
+            time.sleep(options['interval'])
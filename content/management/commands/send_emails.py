@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import time
+
+from django.core.management.base import BaseCommand
+
+from content.mail import Outbox
+
+
+class Command(BaseCommand):
+    help = 'Sends pending emails in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=2,
+                            help='Number of SMTP connections.')
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--backoff', type=int, default=60,
+                            help='Seconds before the first retry; doubled '
+                                 'after every failed attempt.')
+        parser.add_argument('--interval', type=int, default=5,
+                            help='Seconds to sleep when nothing is pending.')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Exit when nothing is pending.')
+
+    def handle(self, *args, **options):
+        outbox = Outbox(batch_size=options['batch_size'],
+                        concurrency=options['concurrency'],
+                        max_attempts=options['max_attempts'],
+                        backoff=options['backoff'])
+        while True:
+            count = outbox.process()
+            if count:
+                self.stdout.write('Processed %d emails' % count)
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
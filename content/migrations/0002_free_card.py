@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 20:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_free_cards(apps, schema_editor):
+    SiteConfiguration = apps.get_model('config', 'SiteConfiguration')
+    Customer = apps.get_model('content', 'Customer')
+    FreeCard = apps.get_model('content', 'FreeCard')
+    conf, created = SiteConfiguration.objects.get_or_create(pk=1)
+    taken = set(Customer.objects.exclude(card=None)
+                .values_list('card', flat=True))
+    FreeCard.objects.bulk_create(
+        (FreeCard(card=card)
+         for card in xrange(conf.card_end, conf.card_start - 1, -1)
+         if card not in taken),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0001_initial'),
+        ('config', '0003_auto_20170320_1509'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FreeCard',
+            fields=[
+                ('card', models.PositiveIntegerField(primary_key=True, serialize=False, verbose_name='\u041d\u043e\u043c\u0435\u0440 \u043a\u0430\u0440\u0442\u044b')),
+            ],
+            options={
+                'verbose_name': '\u0421\u0432\u043e\u0431\u043e\u0434\u043d\u0430\u044f \u043a\u0430\u0440\u0442\u0430',
+                'verbose_name_plural': '\u0421\u0432\u043e\u0431\u043e\u0434\u043d\u044b\u0435 \u043a\u0430\u0440\u0442\u044b',
+            },
+        ),
+        migrations.RunPython(fill_free_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 20:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def count_free_cards(apps, schema_editor):
+    CardStock = apps.get_model('content', 'CardStock')
+    FreeCard = apps.get_model('content', 'FreeCard')
+    CardStock.objects.update_or_create(
+        pk=1, defaults={'available': FreeCard.objects.count()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0002_free_card'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardStock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('available', models.IntegerField(default=0, verbose_name='\u0414\u043e\u0441\u0442\u0443\u043f\u043d\u043e \u043a\u0430\u0440\u0442')),
+            ],
+            options={
+                'verbose_name': '\u041e\u0441\u0442\u0430\u0442\u043e\u043a \u043a\u0430\u0440\u0442',
+            },
+        ),
+        migrations.RunPython(count_free_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 20:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0003_card_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailtask',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='\u041f\u043e\u043f\u044b\u0442\u043e\u043a \u043e\u0442\u043f\u0440\u0430\u0432\u043a\u0438'),
+        ),
+        # Emails created before the outbox were already sent or have failed,
+        # so existing rows get no next attempt
+        migrations.AddField(
+            model_name='emailtask',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='\u0421\u043b\u0435\u0434\u0443\u044e\u0449\u0430\u044f \u043f\u043e\u043f\u044b\u0442\u043a\u0430'),
+        ),
+        migrations.AlterField(
+            model_name='emailtask',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, db_index=True, default=django.utils.timezone.now, null=True, verbose_name='\u0421\u043b\u0435\u0434\u0443\u044e\u0449\u0430\u044f \u043f\u043e\u043f\u044b\u0442\u043a\u0430'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 20:50
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('content', '0005_export_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.IntegerField(choices=[(0, '\u0412 \u043e\u0447\u0435\u0440\u0435\u0434\u0438'), (1, '\u0412\u044b\u043f\u043e\u043b\u043d\u044f\u0435\u0442\u0441\u044f'), (2, '\u0413\u043e\u0442\u043e\u0432\u043e'), (-1, '\u041e\u0448\u0438\u0431\u043a\u0430')], default=0, verbose_name='\u0421\u0442\u0430\u0442\u0443\u0441')),
+                ('rows_total', models.PositiveIntegerField(blank=True, null=True, verbose_name='\u0412\u0441\u0435\u0433\u043e \u0441\u0442\u0440\u043e\u043a')),
+                ('rows_done', models.PositiveIntegerField(default=0, verbose_name='\u041e\u0431\u0440\u0430\u0431\u043e\u0442\u0430\u043d\u043e \u0441\u0442\u0440\u043e\u043a')),
+                ('error', models.TextField(blank=True, verbose_name='\u041e\u0448\u0438\u0431\u043a\u0430')),
+                ('when_created', models.DateTimeField(auto_now_add=True, verbose_name='\u0414\u0430\u0442\u0430 \u0441\u043e\u0437\u0434\u0430\u043d\u0438\u044f')),
+                ('when_started', models.DateTimeField(blank=True, null=True, verbose_name='\u041d\u0430\u0447\u0430\u043b\u043e')),
+                ('when_finished', models.DateTimeField(blank=True, null=True, verbose_name='\u041e\u043a\u043e\u043d\u0447\u0430\u043d\u0438\u0435')),
+                ('fmt', models.CharField(max_length=10, verbose_name='\u0424\u043e\u0440\u043c\u0430\u0442')),
+                ('upsert', models.BooleanField(default=False, verbose_name='\u041e\u0431\u043d\u043e\u0432\u043b\u0435\u043d\u0438\u0435')),
+                ('filename', models.CharField(max_length=255, verbose_name='\u0424\u0430\u0439\u043b')),
+                ('rows_parsed', models.PositiveIntegerField(default=0, verbose_name='\u041f\u0440\u043e\u0447\u0438\u0442\u0430\u043d\u043e \u0441\u0442\u0440\u043e\u043a')),
+                ('rows_validated', models.PositiveIntegerField(default=0, verbose_name='\u041f\u0440\u043e\u0432\u0435\u0440\u0435\u043d\u043e \u0441\u0442\u0440\u043e\u043a')),
+                ('report', models.TextField(blank=True, verbose_name='\u041e\u0442\u0447\u0451\u0442')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='\u0410\u0432\u0442\u043e\u0440')),
+            ],
+            options={
+                'ordering': ('-when_created',),
+                'abstract': False,
+                'verbose_name': '\u0418\u043c\u043f\u043e\u0440\u0442',
+                'verbose_name_plural': '\u0418\u043c\u043f\u043e\u0440\u0442',
+            },
+        ),
+    ]
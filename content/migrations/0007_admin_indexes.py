@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 20:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0006_import_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='email_status',
+            field=models.IntegerField(choices=[(0, '\u041d\u0435 \u0441\u0443\u0449\u0435\u0441\u0442\u0432\u0443\u0435\u0442'), (1, '\u0421\u043e\u0437\u0434\u0430\u043d\u043e'), (2, '\u041e\u0442\u043f\u0440\u0430\u0432\u043b\u0435\u043d\u043e'), (3, '\u041e\u0442\u043a\u0440\u044b\u0442\u043e'), (-1, '\u041d\u0435 \u0443\u0434\u0430\u043b\u043e\u0441\u044c \u043e\u0442\u043f\u0440\u0430\u0432\u0438\u0442\u044c')], db_index=True, default=0, verbose_name='\u041f\u0438\u0441\u044c\u043c\u043e'),
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='ins_end',
+            field=models.DateField(db_index=True, verbose_name='\u0414\u0430\u0442\u0430 \u043e\u043a\u043e\u043d\u0447\u0430\u043d\u0438\u044f \u041e\u0421\u0410\u0413\u041e'),
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='when_created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='\u0414\u0430\u0442\u0430 \u0440\u0435\u0433\u0438\u0441\u0442\u0440\u0430\u0446\u0438\u0438'),
+        ),
+        migrations.AlterField(
+            model_name='emailtask',
+            name='when_created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='\u0414\u0430\u0442\u0430 \u0441\u043e\u0437\u0434\u0430\u043d\u0438\u044f'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 20:57
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('content', '0007_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_id', models.PositiveIntegerField(db_index=True, verbose_name='\u0418\u0441\u0445\u043e\u0434\u043d\u044b\u0439 id')),
+                ('when_created', models.DateTimeField(db_index=True, verbose_name='\u0414\u0430\u0442\u0430 \u0440\u0435\u0433\u0438\u0441\u0442\u0440\u0430\u0446\u0438\u0438')),
+                ('first_name', models.CharField(max_length=50, verbose_name='\u0418\u043c\u044f')),
+                ('middle_name', models.CharField(max_length=50, verbose_name='\u041e\u0442\u0447\u0435\u0441\u0442\u0432\u043e')),
+                ('last_name', models.CharField(max_length=50, verbose_name='\u0424\u0430\u043c\u0438\u043b\u0438\u044f')),
+                ('email', models.EmailField(db_index=True, max_length=254)),
+                ('phone', models.CharField(db_index=True, max_length=10, verbose_name='\u0422\u0435\u043b\u0435\u0444\u043e\u043d')),
+                ('ins_end', models.DateField(verbose_name='\u0414\u0430\u0442\u0430 \u043e\u043a\u043e\u043d\u0447\u0430\u043d\u0438\u044f \u041e\u0421\u0410\u0413\u041e')),
+                ('card', models.PositiveIntegerField(blank=True, db_index=True, null=True, verbose_name='\u041d\u043e\u043c\u0435\u0440 \u043a\u0430\u0440\u0442\u044b')),
+                ('email_status', models.IntegerField(choices=[(0, '\u041d\u0435 \u0441\u0443\u0449\u0435\u0441\u0442\u0432\u0443\u0435\u0442'), (1, '\u0421\u043e\u0437\u0434\u0430\u043d\u043e'), (2, '\u041e\u0442\u043f\u0440\u0430\u0432\u043b\u0435\u043d\u043e'), (3, '\u041e\u0442\u043a\u0440\u044b\u0442\u043e'), (-1, '\u041d\u0435 \u0443\u0434\u0430\u043b\u043e\u0441\u044c \u043e\u0442\u043f\u0440\u0430\u0432\u0438\u0442\u044c')], default=0, verbose_name='\u041f\u0438\u0441\u044c\u043c\u043e')),
+                ('utm_link', models.URLField(blank=True, verbose_name='\u0421\u0441\u044b\u043b\u043a\u0430 UTM')),
+                ('when_archived', models.DateTimeField(db_index=True, verbose_name='\u0414\u0430\u0442\u0430 \u0430\u0440\u0445\u0438\u0432\u0430\u0446\u0438\u0438')),
+            ],
+            options={
+                'verbose_name': '\u0410\u0440\u0445\u0438\u0432\u043d\u044b\u0439 \u043f\u043e\u043b\u044c\u0437\u043e\u0432\u0430\u0442\u0435\u043b\u044c',
+                'verbose_name_plural': '\u0410\u0440\u0445\u0438\u0432 \u043f\u043e\u043b\u044c\u0437\u043e\u0432\u0430\u0442\u0435\u043b\u0435\u0439',
+            },
+        ),
+        migrations.CreateModel(
+            name='EmailTaskArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('when_created', models.DateTimeField(verbose_name='\u0414\u0430\u0442\u0430 \u0441\u043e\u0437\u0434\u0430\u043d\u0438\u044f')),
+                ('when_sent', models.DateTimeField(blank=True, null=True, verbose_name='\u0414\u0430\u0442\u0430 \u043e\u0442\u043f\u0440\u0430\u0432\u043a\u0438')),
+                ('when_opened', models.DateTimeField(blank=True, null=True, verbose_name='\u0414\u0430\u0442\u0430 \u043e\u0442\u043a\u0440\u044b\u0442\u0438\u044f')),
+                ('token', models.CharField(max_length=12, verbose_name='\u0422\u043e\u043a\u0435\u043d')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='\u041f\u043e\u043f\u044b\u0442\u043e\u043a \u043e\u0442\u043f\u0440\u0430\u0432\u043a\u0438')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emails', to='content.CustomerArchive', verbose_name='\u041f\u043e\u043b\u044c\u0437\u043e\u0432\u0430\u0442\u0435\u043b\u044c')),
+            ],
+            options={
+                'verbose_name': '\u0410\u0440\u0445\u0438\u0432\u043d\u043e\u0435 \u043f\u0438\u0441\u044c\u043c\u043e',
+                'verbose_name_plural': '\u0410\u0440\u0445\u0438\u0432 \u043f\u0438\u0441\u0435\u043c',
+            },
+        ),
+        migrations.CreateModel(
+            name='PurgeJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.IntegerField(choices=[(0, '\u0412 \u043e\u0447\u0435\u0440\u0435\u0434\u0438'), (1, '\u0412\u044b\u043f\u043e\u043b\u043d\u044f\u0435\u0442\u0441\u044f'), (2, '\u0413\u043e\u0442\u043e\u0432\u043e'), (-1, '\u041e\u0448\u0438\u0431\u043a\u0430')], default=0, verbose_name='\u0421\u0442\u0430\u0442\u0443\u0441')),
+                ('rows_total', models.PositiveIntegerField(blank=True, null=True, verbose_name='\u0412\u0441\u0435\u0433\u043e \u0441\u0442\u0440\u043e\u043a')),
+                ('rows_done', models.PositiveIntegerField(default=0, verbose_name='\u041e\u0431\u0440\u0430\u0431\u043e\u0442\u0430\u043d\u043e \u0441\u0442\u0440\u043e\u043a')),
+                ('error', models.TextField(blank=True, verbose_name='\u041e\u0448\u0438\u0431\u043a\u0430')),
+                ('when_created', models.DateTimeField(auto_now_add=True, verbose_name='\u0414\u0430\u0442\u0430 \u0441\u043e\u0437\u0434\u0430\u043d\u0438\u044f')),
+                ('when_started', models.DateTimeField(blank=True, null=True, verbose_name='\u041d\u0430\u0447\u0430\u043b\u043e')),
+                ('when_finished', models.DateTimeField(blank=True, null=True, verbose_name='\u041e\u043a\u043e\u043d\u0447\u0430\u043d\u0438\u0435')),
+                ('archive', models.BooleanField(default=False, verbose_name='\u0412 \u0430\u0440\u0445\u0438\u0432')),
+                ('report', models.TextField(blank=True, verbose_name='\u041e\u0442\u0447\u0451\u0442')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='\u0410\u0432\u0442\u043e\u0440')),
+            ],
+            options={
+                'ordering': ('-when_created',),
+                'abstract': False,
+                'verbose_name': '\u041e\u0447\u0438\u0441\u0442\u043a\u0430',
+                'verbose_name_plural': '\u041e\u0447\u0438\u0441\u0442\u043a\u0430',
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 20:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0008_purge_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='archive',
+            field=models.BooleanField(default=False, verbose_name='\u0410\u0440\u0445\u0438\u0432'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 21:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0010_customer_when_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailtask',
+            name='error',
+            field=models.CharField(blank=True, max_length=255, verbose_name='\u041e\u0448\u0438\u0431\u043a\u0430'),
+        ),
+    ]
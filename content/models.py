@@ -2,22 +2,24 @@
 from __future__ import unicode_literals
 import os
 from datetime import timedelta
+from hashlib import md5
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
 from django.utils import timezone
 from django.core import validators
+from django.core.exceptions import ValidationError
 from django.dispatch import receiver
-from django.core.mail.message import EmailMultiAlternatives
-from django.template import Context, Template, loader
+from django.template import Context, Template
 from django.utils.crypto import get_random_string
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from dateutil.relativedelta import relativedelta
 from ckeditor.fields import RichTextField
+from solo.models import SingletonModel
 
-from config.models import SiteConfiguration
-from django.db.models import F
-from email.mime.image import MIMEImage
+from config.cache import LRUCache, CacheVersion, VersionedCache
+from config.models import SiteConfiguration, site_config
+from django.db.models import F, Q
 from django.contrib.staticfiles.templatetags.staticfiles import static
 
 
@@ -65,22 +67,53 @@ class Text(models.Model):
     {{ card }} - карта.
     """)
 
-    def get_template_context(self, customer):
+    @classmethod
+    def get_active(cls):
+        """
+        Shared {place: text} mapping of active texts, loaded by one query and
+        checked once per request.
+        """
+        return active_texts.get()
+
+    def get_template_context(self, customer, conf=None):
         ctx = {}
         for attr in ('first_name', 'middle_name', 'last_name',
                      'phone', 'email'):
             ctx[attr] = getattr(customer, attr)
-        ctx['card'] = customer.get_card_name()
+        ctx['card'] = customer.get_card_name(conf)
         return ctx
 
-    def render(self, data=None):
+    def get_template(self):
+        """
+        Compiled text, cached by id and checked against the text digest.
+        """
+        if self.id is None:
+            return Template(self.text)
+        digest = md5(self.text.encode('utf-8')).digest()
+        cached = compiled_texts.get(self.id)
+        if cached is not None and cached[0] == digest:
+            return cached[1]
         tpl = Template(self.text)
+        compiled_texts.set(self.id, (digest, tpl))
+        return tpl
+
+    def render(self, data=None):
+        tpl = self.get_template()
         ctx = data or {}
         if isinstance(ctx, Customer):
             ctx = self.get_template_context(data)
         return tpl.render(Context(ctx))
 
 
+compiled_texts = LRUCache(maxsize=32)
+active_texts = VersionedCache(
+    'content:texts', lambda: {t.place: t for t in Text.objects.active()}
+)
+
+# Changes with anything shown on the landing page except the card counter
+landing_version = CacheVersion('landing:version')
+
+
 class Service(models.Model):
     class Meta:
         verbose_name = 'Услуга'
@@ -140,10 +173,48 @@ class CustomerManager(models.Manager):
         return self.has_cards(*args, **kwargs).values_list('card', flat=True)
 
     def avail_cards_count(self):
-        conf = SiteConfiguration.get_solo()
-        exist = self.has_cards(card__gte=conf.card_start,
-                               card__lte=conf.card_end).count()
-        return conf.get_cards_count() - exist
+        return CardStock.get_solo().available
+
+    def archived_cards(self, start, end):
+        """
+        Cards from ``start`` to ``end`` held by archived customers only;
+        they are never handed out again. Customers are excluded by a
+        NOT IN subquery, so nothing is loaded.
+        """
+        issued = self.existing_cards(card__gte=start, card__lte=end)
+        return CustomerArchive.objects \
+            .filter(card__gte=start, card__lte=end) \
+            .exclude(card__in=issued) \
+            .values_list('card', flat=True).distinct()
+
+    def count_avail_cards(self, conf=None):
+        """
+        Counts free cards over the tables; avail_cards_count reads the
+        maintained figure instead.
+        """
+        conf = conf or SiteConfiguration.get_cached()
+        start, end = conf.card_start, conf.card_end
+        issued = self.has_cards(card__gte=start, card__lte=end).count()
+        archived = self.archived_cards(start, end).count()
+        return conf.get_cards_count() - issued - archived
+
+    def signup(self, customer):
+        """
+        Saves a new customer with a card and an email task in one
+        transaction. Unique values are checked by the indexes on insert;
+        only if it fails they are looked up to raise the ValidationError
+        of validate_unique(). Returns the number of cards left.
+        """
+        try:
+            with transaction.atomic(using=self.db):
+                customer.save(using=self.db)
+        except IntegrityError:
+            # The card went back to the pool with the rollback
+            customer.pk = customer.card = customer._pool_card = None
+            customer.validate_unique()
+            raise
+        avail = getattr(customer, '_cards_avail', None)
+        return self.avail_cards_count() if avail is None else avail
 
 
 class Customer(models.Model):
@@ -158,7 +229,10 @@ class Customer(models.Model):
 
     objects = CustomerManager()
 
-    when_created = models.DateTimeField('Дата регистрации', auto_now_add=True)
+    # Not auto_now_add, which would overwrite the dates of imported rows
+    when_created = models.DateTimeField('Дата регистрации',
+                                        default=timezone.now, editable=False,
+                                        db_index=True)
     first_name = models.CharField('Имя', max_length=50)
     middle_name = models.CharField('Отчество', max_length=50)
     last_name = models.CharField('Фамилия', max_length=50)
@@ -167,30 +241,187 @@ class Customer(models.Model):
                              validators=[
                                  validators.RegexValidator(PHONE_RE)
                              ])
-    ins_end = models.DateField('Дата окончания ОСАГО')
+    ins_end = models.DateField('Дата окончания ОСАГО', db_index=True)
     card = models.PositiveIntegerField('Номер карты', unique=True,
                                        blank=True, null=True)
     email_status = models.IntegerField('Письмо', choices=EmailStatus._CHOICES,
-                                       default=EmailStatus.NOT_EXIST)
+                                       default=EmailStatus.NOT_EXIST,
+                                       db_index=True)
     utm_link = models.URLField('Ссылка UTM', blank=True)
 
     def get_full_name(self):
         return ' '.join((self.last_name, self.first_name, self.middle_name))
 
+    def clean(self):
+        # Cards of archived customers are never issued again
+        if self.card is not None \
+                and self.card != getattr(self, '_pool_card', None) \
+                and CustomerArchive.objects.filter(card=self.card).exists():
+            raise ValidationError(
+                {'card': 'Карта выдана архивному пользователю'}
+            )
+
     def card_valid_since(self, delay=1):
         return self.when_created.date() + timedelta(days=delay)
 
     def card_valid_till(self, months=3):
         return self.card_valid_since() + relativedelta(months=months)
 
-    def get_card_name(self):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Customer, cls).from_db(db, field_names, values)
+        instance._pool_card = instance.__dict__.get('card')
+        return instance
+
+    def get_card_name(self, conf=None):
         if self.card is None:
             return ''
-        conf = SiteConfiguration.get_solo()
+        conf = conf or SiteConfiguration.get_cached()
         letters = conf.card_letters
         return '{0} {1}'.format(letters, self.card)
 
 
+class FreeCardManager(models.Manager):
+    def lock_config(self):
+        """
+        Locks the configuration row; every pool change is serialized on it.
+        """
+        conf, created = SiteConfiguration.objects.select_for_update() \
+            .get_or_create(pk=1)
+        return conf
+
+    def adjust_stock(self, delta):
+        if delta:
+            CardStock.objects.filter(pk=1) \
+                .update(available=F('available') + delta)
+
+    def fill(self, start, end):
+        """
+        Adds the cards from ``start`` to ``end`` not held by customers or
+        archived customers to the pool, returns their number. The taken
+        ones are removed by one DELETE with subqueries, without loading the
+        issued cards.
+        """
+        if end < start:
+            return 0
+        self.bulk_create([FreeCard(card=card)
+                          for card in xrange(end, start - 1, -1)],
+                         batch_size=1000)
+        taken = Q(card__in=Customer.objects.existing_cards(card__gte=start,
+                                                           card__lte=end))
+        taken |= Q(card__in=CustomerArchive.objects
+                   .filter(card__gte=start, card__lte=end).values('card'))
+        deleted, rows = self.filter(taken, card__gte=start,
+                                    card__lte=end).delete()
+        added = end - start + 1 - deleted
+        self.adjust_stock(added)
+        return added
+
+    def rebuild(self):
+        with transaction.atomic():
+            conf = self.lock_config()
+            self.all().delete()
+            CardStock.objects.update_or_create(pk=1,
+                                               defaults={'available': 0})
+            self.fill(conf.card_start, conf.card_end)
+
+    def pop(self):
+        card = self.order_by('-card').values_list('card', flat=True).first()
+        if card is not None:
+            self.take(card)
+        return card
+
+    def allocate(self):
+        """
+        Hands out the highest free card and extends the range by
+        ``increase_by`` when no more than ``lower_limit`` cards are left.
+        Returns the card and the number of cards left. Joins the current
+        transaction without a savepoint.
+        """
+        with transaction.atomic(savepoint=False):
+            conf = self.lock_config()
+            avail = CardStock.get_solo().available
+            card = self.pop()
+            if avail <= conf.lower_limit:
+                start = conf.card_end + 1
+                conf.card_end += conf.increase_by
+                SiteConfiguration.objects.filter(pk=conf.pk) \
+                    .update(card_end=F('card_end') + conf.increase_by)
+                site_config.invalidate()
+                avail += self.fill(start, conf.card_end)
+                if card is None:
+                    card = self.pop()
+            if card is not None:
+                avail -= 1
+            return card, avail
+
+    def take(self, card):
+        """
+        Removes the card from the pool; the caller holds the config lock.
+        """
+        deleted, rows = self.filter(card=card).delete()
+        self.adjust_stock(-deleted)
+
+    def claim(self, card):
+        with transaction.atomic():
+            self.lock_config()
+            self.take(card)
+
+    def release(self, card):
+        with transaction.atomic():
+            conf = self.lock_config()
+            if conf.card_start <= card <= conf.card_end:
+                obj, created = self.get_or_create(card=card)
+                self.adjust_stock(int(created))
+
+
+class FreeCard(models.Model):
+    """
+    Card numbers of the current range that are not issued yet.
+    """
+    class Meta:
+        verbose_name = 'Свободная карта'
+        verbose_name_plural = 'Свободные карты'
+
+    def __unicode__(self):
+        return unicode(self.card)
+
+    objects = FreeCardManager()
+
+    card = models.PositiveIntegerField('Номер карты', primary_key=True)
+
+
+class CardStock(SingletonModel):
+    """
+    Number of free cards, changed together with the FreeCard pool.
+    """
+    class Meta:
+        verbose_name = 'Остаток карт'
+
+    def __unicode__(self):
+        return 'Остаток карт'
+
+    available = models.IntegerField('Доступно карт', default=0)
+
+
+class EmailTaskManager(models.Manager):
+    def pending(self, now=None):
+        return self.filter(when_sent=None,
+                           next_attempt__lte=now or timezone.now())
+
+    def mark_opened(self, token):
+        """
+        Records the first opening of the email without loading any rows.
+        """
+        opened = self.filter(when_opened=None, token=token) \
+            .update(when_opened=timezone.now())
+        if opened:
+            Customer.objects.filter(emails__token=token) \
+                .exclude(email_status=EmailStatus.OPENED) \
+                .update(email_status=EmailStatus.OPENED)
+        return bool(opened)
+
+
 class EmailTask(models.Model):
     class Meta:
         verbose_name = 'Письмо'
@@ -200,13 +431,21 @@ class EmailTask(models.Model):
     def __unicode__(self):
         return self.get_status_display()
 
+    objects = EmailTaskManager()
+
     customer = models.ForeignKey(Customer, verbose_name='Пользователь',
                                  related_name='emails')
-    when_created = models.DateTimeField('Дата создания', auto_now_add=True)
+    when_created = models.DateTimeField('Дата создания', auto_now_add=True,
+                                        db_index=True)
     when_sent = models.DateTimeField('Дата отправки', blank=True, null=True)
     when_opened = models.DateTimeField('Дата открытия', blank=True, null=True)
     token = models.CharField('Токен', max_length=12, default=get_random_string,
                              unique=True)
+    attempts = models.PositiveSmallIntegerField('Попыток отправки', default=0)
+    next_attempt = models.DateTimeField('Следующая попытка', blank=True,
+                                        null=True, db_index=True,
+                                        default=timezone.now)
+    error = models.CharField('Ошибка', max_length=255, blank=True)
 
     def get_status(self):
         if self.when_opened:
@@ -219,19 +458,193 @@ class EmailTask(models.Model):
         return EmailStatus._DISPLAY[self.get_status()]
 
 
+class CustomerArchive(models.Model):
+    """
+    Customers moved out of Customer, copied by Purger with INSERT ... SELECT.
+    ``source_id`` is the id the customer had, ids may repeat after a purge.
+    Their cards stay reserved.
+    """
+    class Meta:
+        verbose_name = 'Архивный пользователь'
+        verbose_name_plural = 'Архив пользователей'
+
+    def __unicode__(self):
+        return self.get_full_name()
+
+    source_id = models.PositiveIntegerField('Исходный id', db_index=True)
+    when_created = models.DateTimeField('Дата регистрации', db_index=True)
+    first_name = models.CharField('Имя', max_length=50)
+    middle_name = models.CharField('Отчество', max_length=50)
+    last_name = models.CharField('Фамилия', max_length=50)
+    email = models.EmailField(db_index=True)
+    phone = models.CharField('Телефон', max_length=10, db_index=True)
+    ins_end = models.DateField('Дата окончания ОСАГО')
+    card = models.PositiveIntegerField('Номер карты', blank=True, null=True,
+                                       db_index=True)
+    email_status = models.IntegerField('Письмо', choices=EmailStatus._CHOICES,
+                                       default=EmailStatus.NOT_EXIST)
+    utm_link = models.URLField('Ссылка UTM', blank=True)
+    when_archived = models.DateTimeField('Дата архивации', db_index=True)
+
+    def get_full_name(self):
+        return ' '.join((self.last_name, self.first_name, self.middle_name))
+
+    def get_card_name(self, conf=None):
+        if self.card is None:
+            return ''
+        conf = conf or SiteConfiguration.get_cached()
+        return '{0} {1}'.format(conf.card_letters, self.card)
+
+
+class EmailTaskArchive(models.Model):
+    class Meta:
+        verbose_name = 'Архивное письмо'
+        verbose_name_plural = 'Архив писем'
+
+    def __unicode__(self):
+        return self.token
+
+    customer = models.ForeignKey(CustomerArchive, verbose_name='Пользователь',
+                                 related_name='emails')
+    when_created = models.DateTimeField('Дата создания')
+    when_sent = models.DateTimeField('Дата отправки', blank=True, null=True)
+    when_opened = models.DateTimeField('Дата открытия', blank=True, null=True)
+    token = models.CharField('Токен', max_length=12)
+    attempts = models.PositiveSmallIntegerField('Попыток отправки', default=0)
+
+
+class JobStatus:
+    FAILED = -1
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+    _CHOICES = ((PENDING, 'В очереди'),
+                (RUNNING, 'Выполняется'),
+                (DONE, 'Готово'),
+                (FAILED, 'Ошибка'))
+
+
+class Job(models.Model):
+    """
+    Work done by the run_jobs management command outside of requests.
+    """
+    class Meta:
+        abstract = True
+        ordering = ('-when_created',)
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name='Автор',
+                             blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    status = models.IntegerField('Статус', choices=JobStatus._CHOICES,
+                                 default=JobStatus.PENDING)
+    rows_total = models.PositiveIntegerField('Всего строк', blank=True,
+                                             null=True)
+    rows_done = models.PositiveIntegerField('Обработано строк', default=0)
+    error = models.TextField('Ошибка', blank=True)
+    when_created = models.DateTimeField('Дата создания', auto_now_add=True)
+    when_started = models.DateTimeField('Начало', blank=True, null=True)
+    when_finished = models.DateTimeField('Окончание', blank=True, null=True)
+
+    def get_progress(self):
+        if not self.rows_total:
+            return ''
+        return '{0}%'.format(100 * self.rows_done // self.rows_total)
+
+
+class ExportJob(Job):
+    class Meta(Job.Meta):
+        verbose_name = 'Экспорт'
+        verbose_name_plural = 'Экспорт'
+
+    def __unicode__(self):
+        return '{0} {1}'.format(self.fmt, self.when_created)
+
+    fmt = models.CharField('Формат', max_length=10)
+    archive = models.BooleanField('Архив', default=False)
+    params = models.TextField('Фильтры', blank=True)
+    filename = models.CharField('Файл', max_length=255, blank=True)
+
+    def get_path(self):
+        return os.path.join(settings.EXPORT_ROOT, self.filename)
+
+
+class ImportJob(Job):
+    """
+    Import of an uploaded file; rows_total and rows_done count the rows
+    to write and the written ones.
+    """
+    class Meta(Job.Meta):
+        verbose_name = 'Импорт'
+        verbose_name_plural = 'Импорт'
+
+    def __unicode__(self):
+        return '{0} {1}'.format(self.fmt, self.when_created)
+
+    fmt = models.CharField('Формат', max_length=10)
+    upsert = models.BooleanField('Обновление', default=False)
+    filename = models.CharField('Файл', max_length=255)
+    rows_parsed = models.PositiveIntegerField('Прочитано строк', default=0)
+    rows_validated = models.PositiveIntegerField('Проверено строк',
+                                                 default=0)
+    report = models.TextField('Отчёт', blank=True)
+
+    def get_path(self):
+        return os.path.join(settings.IMPORT_ROOT, self.filename)
+
+
+class PurgeJob(Job):
+    """
+    Removal of all customers and their email tasks; rows_total and
+    rows_done count the customers.
+    """
+    class Meta(Job.Meta):
+        verbose_name = 'Очистка'
+        verbose_name_plural = 'Очистка'
+
+    def __unicode__(self):
+        return '{0}'.format(self.when_created)
+
+    archive = models.BooleanField('В архив', default=False)
+    report = models.TextField('Отчёт', blank=True)
+
+
 @receiver(pre_save, sender=Customer)
 def on_customer_create(sender, instance, **kwargs):
-    if instance.id or instance.card:
+    if instance.id:
+        return
+    if instance.email_status == EmailStatus.NOT_EXIST:
+        instance.email_status = EmailStatus.CREATED
+    if instance.card:
         return
-    conf = SiteConfiguration.get_solo()
-    existing_cards = set(Customer.objects.existing_cards())
-    for card in conf.get_cards_range():
-        if card not in existing_cards:
-            instance.card = card
-            break
-    if Customer.objects.avail_cards_count() <= conf.lower_limit:
-        conf.card_end = F('card_end') + conf.increase_by
-        conf.save()
+    instance.card, instance._cards_avail = FreeCard.objects.allocate()
+    instance._pool_card = instance.card
+
+
+@receiver(post_save, sender=Customer)
+def on_customer_card_change(sender, instance, **kwargs):
+    old = getattr(instance, '_pool_card', None)
+    if instance.card == old:
+        return
+    if instance.card is not None:
+        FreeCard.objects.claim(instance.card)
+    if old is not None:
+        FreeCard.objects.release(old)
+    instance._pool_card = instance.card
+
+
+@receiver(post_delete, sender=Customer)
+def on_customer_delete(sender, instance, **kwargs):
+    if instance.card is not None:
+        FreeCard.objects.release(instance.card)
+
+
+@receiver(post_save, sender=SiteConfiguration)
+def on_config_save(sender, instance, **kwargs):
+    card_range = (instance.card_start, instance.card_end)
+    if card_range == getattr(instance, '_card_range', None):
+        return
+    instance._card_range = card_range
+    FreeCard.objects.rebuild()
 
 
 @receiver(post_save, sender=Customer)
@@ -243,50 +656,30 @@ def on_new_customer_saved(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=EmailTask)
 def on_email_task_save(sender, instance, created, **kwargs):
-    if created:
-        try:
-            tpl = Text.objects.active().get(place=Text.PLACE.EMAIL)
-        except Text.DoesNotExist:
-            return
-        ctx = tpl.get_template_context(instance.customer)
-        text = tpl.render(data=ctx)
-        ctx['msg'] = text
-        ctx['token'] = instance.token
-        ctx['site_url'] = settings.SITE_URL
-        tpl = loader.get_template('email_card.html')
-        text = tpl.render(Context(ctx))
-        conf = SiteConfiguration.get_solo()
-        msg = EmailMultiAlternatives(subject=conf.email_subject,
-                                     body=text, to=[instance.customer.email],
-                                     from_email=settings.DEFAULT_FROM_EMAIL)
-        msg.attach_alternative(text, 'text/html')
-        card_img = MIMEImage(open('content/static/img/card-h.png', 'rb').read())
-        card_img.add_header('Content-ID', '<card_image>')
-        logo = MIMEImage(open('content/static/img/logo.png', 'rb').read())
-        logo.add_header('Content-ID', '<logo>')
-        bac_logo = MIMEImage(open('content/static/img/BAC_Logo.png', 'rb').read())
-        bac_logo.add_header('Content-ID', '<bac_logo>')
-        msg.attach(card_img)
-        msg.attach(logo)
-        msg.attach(bac_logo)
-        try:
-            msg.send(fail_silently=False)
-        except:
-            instance.customer.email_status = EmailStatus.FAILED
-        else:
-            instance.customer.email_status = EmailStatus.SENT
-            instance.when_sent = timezone.now()
-            instance.save()
-        finally:
-            instance.customer.save()
-    else:
-        if instance.when_opened \
-                and instance.customer.email_status != EmailStatus.OPENED:
-            instance.customer.email_status = EmailStatus.OPENED
-            instance.customer.save()
+    if not created and instance.when_opened \
+            and instance.customer.email_status != EmailStatus.OPENED:
+        instance.customer.email_status = EmailStatus.OPENED
+        instance.customer.save()
 
 
 @receiver(pre_save, sender=Text)
 def on_text_save(sender, instance, **kwargs):
+    compiled_texts.delete(instance.id)
+    active_texts.invalidate()
     if instance.is_active:
         sender.objects.filter(place=instance.place).update(is_active=False)
+
+
+@receiver(post_delete, sender=Text)
+def on_text_delete(sender, instance, **kwargs):
+    compiled_texts.delete(instance.id)
+    active_texts.invalidate()
+
+
+@receiver(post_save, sender=Text)
+@receiver(post_delete, sender=Text)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=SiteConfiguration)
+def on_landing_content_change(sender, **kwargs):
+    landing_version.bump()
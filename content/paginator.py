@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.encoding import force_text
+from django.utils.functional import cached_property
+
+
+def get_seek_fields(qs):
+    """
+    Returns the names of the ordering fields of ``qs`` and whether the
+    order is descending if rows can be sought by them: the ordering ends
+    with the primary key, all fields go in one direction and none of them
+    is nullable (NULL compares to nothing). Otherwise returns None.
+    """
+    if qs.query.extra_order_by:
+        return None
+    opts = qs.model._meta
+    names, directions = [], set()
+    for field in qs.query.order_by:
+        name = field.lstrip('-')
+        name = 'pk' if name == opts.pk.name else name
+        if '__' in name or '.' in name or '?' in name:
+            return None
+        if name in names:
+            continue
+        if name != 'pk':
+            try:
+                model_field = opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            # Relations are ordered by the related model's ordering
+            if model_field.null or model_field.is_relation:
+                return None
+        names.append(name)
+        directions.add(field.startswith('-'))
+        if name == 'pk':
+            # Later fields do not change the order
+            break
+    if not names or names[-1] != 'pk' or len(directions) != 1:
+        return None
+    return names, directions.pop()
+
+
+def seek(qs, names, descending, values, inclusive=False):
+    """
+    Filters ``qs`` to rows following ``values`` of fields ``names`` in
+    its order; (a, b) > (x, y) is written as a > x OR (a = x AND b > y).
+    """
+    op = 'lt' if descending else 'gt'
+    q = Q()
+    equal = {}
+    for name, value in zip(names, values):
+        q |= Q(**dict(equal, **{'%s__%s' % (name, op): value}))
+        equal[name] = value
+    if inclusive:
+        q |= Q(**equal)
+    return qs.filter(q)
+
+
+def estimate_count(qs):
+    """
+    Returns the number of rows of the whole table of ``qs`` estimated by
+    MySQL from table statistics, or None if there is no estimate. Filtered
+    querysets are not estimated: the optimizer's figures for them can be
+    off by orders of magnitude.
+    """
+    connection = connections[qs.db]
+    if connection.vendor != 'mysql' or qs.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT table_rows FROM information_schema.tables '
+                       'WHERE table_schema = DATABASE() '
+                       'AND table_name = %s', [qs.model._meta.db_table])
+        row = cursor.fetchone()
+        return row and row[0]
+
+
+class KeysetPaginator(Paginator):
+    """
+    Paginator for large tables.
+
+    Counts of unfiltered tables above ``exact_count_limit`` rows are
+    estimated instead of running COUNT(*). For querysets ordered by fields
+    ending with the primary key a page is sought from the key of the last
+    row of the previous page (``after``) or of the first row of the next
+    one (``before``), as given by dump_key(). Without them the key of the
+    page's first row is found by an index scan with OFFSET.
+    """
+    exact_count_limit = 10000
+
+    def __init__(self, *args, **kwargs):
+        self.after = kwargs.pop('after', None)
+        self.before = kwargs.pop('before', None)
+        super(KeysetPaginator, self).__init__(*args, **kwargs)
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is not None and estimate > self.exact_count_limit:
+            return estimate
+        return super(KeysetPaginator, self).count
+
+    @cached_property
+    def seek_fields(self):
+        return get_seek_fields(self.object_list)
+
+    def dump_key(self, obj):
+        """
+        Returns the ordering key of ``obj`` for the query string.
+        """
+        names, descending = self.seek_fields
+        return json.dumps([force_text(getattr(obj, name)) for name in names])
+
+    def load_key(self, value):
+        """
+        Parses a key made by dump_key(), returns None if it is not valid.
+        """
+        if not value:
+            return None
+        opts = self.object_list.model._meta
+        names, descending = self.seek_fields
+        try:
+            values = json.loads(value)
+            if not isinstance(values, list) or len(values) != len(names):
+                return None
+            return [(opts.pk if name == 'pk' else opts.get_field(name))
+                    .to_python(text) for name, text in zip(names, values)]
+        except (TypeError, ValueError, ValidationError):
+            return None
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if number == 1 or self.seek_fields is None:
+            return super(KeysetPaginator, self).page(number)
+        names, descending = self.seek_fields
+        after, before = self.load_key(self.after), self.load_key(self.before)
+        if after is not None:
+            objs = seek(self.object_list, names, descending, after)
+        elif before is not None:
+            # The preceding rows are read in reverse order
+            rows = list(seek(self.object_list.reverse(), names,
+                             not descending, before)[:self.per_page])
+            if len(rows) == self.per_page:
+                return self._get_page(rows[::-1], number, self)
+            # Rows were deleted since, the first ones are shown
+            objs = self.object_list
+        else:
+            bottom = (number - 1) * self.per_page
+            first = list(self.object_list.values_list(*names)
+                         [bottom:bottom + 1])
+            if not first:
+                return self._get_page([], number, self)
+            objs = seek(self.object_list, names, descending, first[0],
+                        inclusive=True)
+        return self._get_page(objs[:self.per_page], number, self)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from content.models import Customer, CustomerArchive, EmailTask, \
+    EmailTaskArchive, FreeCard
+
+
+def get_copied_fields(source, target):
+    """
+    Returns (source column, target column) pairs of the plain fields
+    ``target`` shares by name with ``source``.
+    """
+    columns = {f.name: f.column for f in source._meta.concrete_fields}
+    return [(columns[f.name], f.column)
+            for f in target._meta.concrete_fields
+            if f.name in columns and not f.primary_key and not f.is_relation]
+
+
+class Purger(object):
+    """
+    Deletes customers of ``queryset`` (all by default) with their email
+    tasks, ``chunk_size`` customers per transaction, without loading rows
+    or sending signals. With ``archive`` the rows of a chunk are first
+    copied into CustomerArchive and EmailTaskArchive by INSERT ... SELECT.
+    All customers are deleted on MySQL without archiving by truncating the
+    tables, unless ``allow_truncate`` is off: TRUNCATE commits the current
+    transaction. Archived cards stay reserved, otherwise the card pool is
+    rebuilt at the end.
+    """
+    chunk_size = 1000
+
+    def __init__(self, queryset=None, archive=False, progress=None,
+                 allow_truncate=True):
+        if queryset is None:
+            queryset = Customer.objects.all()
+        self.queryset = queryset
+        self.db = queryset.db
+        self.archive = archive
+        self.allow_truncate = allow_truncate
+        # Called with the purger after every chunk
+        self.progress = progress
+        self.rows_total = 0
+        self.rows_done = 0
+
+    def report(self):
+        if self.progress is not None:
+            self.progress(self)
+
+    def get_report(self):
+        if self.archive:
+            return 'Перенесено в архив: %d' % self.rows_done
+        return 'Удалено: %d' % self.rows_done
+
+    def can_truncate(self):
+        return (self.allow_truncate and not self.archive
+                and not self.queryset.query.where
+                and connections[self.db].vendor == 'mysql')
+
+    def truncate(self):
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            # Customer is referenced by EmailTask even when it is empty
+            cursor.execute('SET FOREIGN_KEY_CHECKS = 0')
+            try:
+                for model in (EmailTask, Customer):
+                    cursor.execute('TRUNCATE TABLE %s'
+                                   % qn(model._meta.db_table))
+            finally:
+                cursor.execute('SET FOREIGN_KEY_CHECKS = 1')
+
+    def chunks(self):
+        """
+        Yields lists of ids of the customers existing at the start.
+        """
+        qs = self.queryset.order_by('pk').values_list('pk', flat=True)
+        last = qs.last()
+        if last is None:
+            return
+        qs = qs.filter(pk__lte=last)
+        ids = [0]
+        while True:
+            ids = list(qs.filter(pk__gt=ids[-1])[:self.chunk_size])
+            if not ids:
+                return
+            yield ids
+
+    def archive_chunk(self, cursor, ids):
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        customers, archive = Customer._meta, CustomerArchive._meta
+        tasks, task_archive = EmailTask._meta, EmailTaskArchive._meta
+        marks = ', '.join(['%s'] * len(ids))
+
+        # Archive rows of the locked chunk customers are only added below
+        cursor.execute('SELECT MAX(%s) FROM %s'
+                       % (qn(archive.pk.column), qn(archive.db_table)))
+        since = cursor.fetchone()[0] or 0
+
+        fields = get_copied_fields(Customer, CustomerArchive)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        cursor.execute(
+            'INSERT INTO {archive} ({source_id}, {when_archived}, {targets}) '
+            'SELECT {pk}, %s, {sources} FROM {table} '
+            'WHERE {pk} IN ({marks})'.format(
+                archive=qn(archive.db_table),
+                source_id=qn(archive.get_field('source_id').column),
+                when_archived=qn(archive.get_field('when_archived').column),
+                targets=', '.join(qn(target) for source, target in fields),
+                pk=qn(customers.pk.column),
+                sources=', '.join(qn(source) for source, target in fields),
+                table=qn(customers.db_table),
+                marks=marks,
+            ), [now] + ids
+        )
+
+        # Tasks refer to the archive rows just added for their customers
+        fields = get_copied_fields(EmailTask, EmailTaskArchive)
+        cursor.execute(
+            'INSERT INTO {task_archive} ({customer}, {targets}) '
+            'SELECT a.{pk}, t.{sources} FROM {tasks} t '
+            'INNER JOIN {archive} a ON a.{source_id} = t.{task_customer} '
+            'WHERE a.{pk} > %s AND t.{task_customer} IN ({marks})'.format(
+                task_archive=qn(task_archive.db_table),
+                customer=qn(task_archive.get_field('customer').column),
+                targets=', '.join(qn(target) for source, target in fields),
+                pk=qn(archive.pk.column),
+                sources=', t.'.join(qn(source) for source, target in fields),
+                tasks=qn(tasks.db_table),
+                archive=qn(archive.db_table),
+                source_id=qn(archive.get_field('source_id').column),
+                task_customer=qn(tasks.get_field('customer').column),
+                marks=marks,
+            ), [since] + ids
+        )
+
+    def delete_chunk(self, cursor, ids):
+        # EmailTask has no delete signals or dependent rows, so this is a
+        # single DELETE. Customer.delete() would load every customer to
+        # return its card to the pool one by one through post_delete; the
+        # pool is kept or rebuilt by run() instead, hence the plain DELETE.
+        EmailTask.objects.using(self.db).filter(customer__in=ids).delete()
+        opts = Customer._meta
+        qn = connections[self.db].ops.quote_name
+        cursor.execute('DELETE FROM %s WHERE %s IN (%s)'
+                       % (qn(opts.db_table), qn(opts.pk.column),
+                          ', '.join(['%s'] * len(ids))), ids)
+
+    def purge_chunk(self, ids):
+        """
+        Archives and deletes the customers of ``ids`` that still exist,
+        returns their number. They stay locked from the archive bound read
+        by archive_chunk to their deletion, so no other purge or change
+        gets in between.
+        """
+        with transaction.atomic(using=self.db):
+            ids = list(Customer.objects.using(self.db).filter(pk__in=ids)
+                       .select_for_update().order_by('pk')
+                       .values_list('pk', flat=True))
+            if not ids:
+                return 0
+            with connections[self.db].cursor() as cursor:
+                if self.archive:
+                    self.archive_chunk(cursor, ids)
+                self.delete_chunk(cursor, ids)
+        return len(ids)
+
+    def purge(self):
+        """
+        Deletes or archives the customers, leaving the card pool as is.
+        """
+        self.rows_total = self.queryset.count()
+        self.report()
+        if self.can_truncate():
+            self.truncate()
+            self.rows_done = self.rows_total
+        else:
+            for ids in self.chunks():
+                self.rows_done += self.purge_chunk(ids)
+                self.report()
+
+    def run(self):
+        self.purge()
+        if not self.archive:
+            FreeCard.objects.rebuild()
+            self.report()
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import gzip
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext, patch_logger
+from django.utils import timezone
+
+from content.export import CSVFormatter, GzipFormatter, XLSXFormatter, \
+    ZipFormatter
+from content.export.customer import as_csv, as_xlsx
+from content.imports import read_xlsx
+from content.jobs import ImportRunner
+from content.mail import Outbox, email_assets
+from content.purge import Purger
+from content.imports.customer import import_file
+from config.models import SiteConfiguration
+from content.models import Customer, CustomerArchive, EmailStatus, \
+    EmailTask, EmailTaskArchive, FreeCard, ImportJob, JobStatus
+from content.paginator import KeysetPaginator
+from content.views import LandingView
+
+
+def create_customers(count):
+    Customer.objects.bulk_create([
+        Customer(first_name='Имя', middle_name='Отчество', last_name='Фамилия',
+                 email='user%d@example.com' % i, phone='0%09d' % i,
+                 ins_end=date(2030, 1, 1), card=i + 1)
+        for i in xrange(count)
+    ])
+    return list(Customer.objects.order_by('pk'))
+
+
+class KeysetPaginatorTest(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        EmailTask.objects.bulk_create([
+            EmailTask(customer=customer, token='t%011d' % i,
+                      # Every third email is not sent, a few share the time
+                      when_sent=None if i % 3 == 0
+                      else now - timedelta(minutes=i // 2))
+            for i, customer in enumerate(create_customers(250))
+        ])
+
+    def assertSamePages(self, qs, per_page=100):
+        expected = Paginator(qs, per_page)
+        paginator = KeysetPaginator(qs, per_page)
+        for number in expected.page_range:
+            self.assertEqual([obj.pk for obj in paginator.page(number)],
+                             [obj.pk for obj in expected.page(number)])
+
+    def test_nullable_ordering(self):
+        for ordering in (('-when_sent', '-id'), ('when_sent', 'id')):
+            self.assertSamePages(EmailTask.objects.order_by(*ordering))
+
+    def test_ordering(self):
+        self.assertSamePages(EmailTask.objects.order_by('-when_created',
+                                                        '-id'))
+
+    def test_seek_from_adjacent_pages(self):
+        qs = EmailTask.objects.order_by('-when_created', '-id')
+        expected = Paginator(qs, 40)
+        numbers = list(expected.page_range)
+        pages = [list(expected.page(1))]
+        with CaptureQueriesContext(connection) as queries:
+            # Forward from the last row of each page, then back from the
+            # first one
+            for number in numbers[1:]:
+                paginator = KeysetPaginator(qs, 40)
+                paginator.after = paginator.dump_key(pages[-1][-1])
+                pages.append(list(paginator.page(number)))
+            for number in reversed(numbers[1:-1]):
+                paginator = KeysetPaginator(qs, 40)
+                paginator.before = paginator.dump_key(pages[number][0])
+                self.assertEqual(list(paginator.page(number)),
+                                 pages[number - 1])
+        self.assertEqual(pages, [list(expected.page(number))
+                                 for number in numbers])
+        self.assertFalse([q for q in queries if 'OFFSET' in q['sql']])
+
+    def test_admin_next_page_link(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        url = changelist = '/admin/content/emailtask/'
+        expected = Paginator(EmailTask.objects.order_by('-when_created',
+                                                        '-id'), 100)
+        for number in expected.page_range:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            cl = response.context['cl']
+            self.assertEqual(list(cl.result_list),
+                             list(expected.page(number)))
+            url = changelist + cl.get_query_string({'p': number})
+            self.assertIn('after=', url)
+        # Back to the previous page from the last one
+        url = changelist + cl.get_query_string({'p': 1})
+        self.assertIn('before=', url)
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['cl'].result_list),
+                         list(expected.page(2)))
+
+    def test_admin_nullable_ordering(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        shown = set()
+        for page in (0, 1, 2):
+            response = self.client.get('/admin/content/emailtask/',
+                                       {'o': '-2', 'p': page})
+            self.assertEqual(response.status_code, 200)
+            shown.update(obj.pk for obj in
+                         response.context['cl'].result_list)
+        self.assertEqual(len(shown), EmailTask.objects.count())
+
+
+class OutboxTest(TestCase):
+    def test_no_email_text(self):
+        EmailTask.objects.bulk_create([EmailTask(customer=customer)
+                                       for customer in create_customers(5)])
+        outbox = Outbox(max_attempts=2, backoff=0)
+        with patch_logger('content.mail', 'error') as calls:
+            self.assertEqual(outbox.process(), 5)
+            self.assertEqual(EmailTask.objects.pending().count(), 5)
+            self.assertEqual(outbox.process(), 5)
+        self.assertEqual(len(calls), 2)
+        # Given up, so nothing is sent when a text is activated
+        self.assertFalse(EmailTask.objects.pending().exists())
+        for task in EmailTask.objects.select_related('customer'):
+            self.assertEqual(task.attempts, 2)
+            self.assertEqual(task.error, 'Нет активного текста письма')
+            self.assertIsNone(task.when_sent)
+            self.assertEqual(task.customer.email_status, EmailStatus.FAILED)
+
+
+class EmailAssetsTest(TestCase):
+    def test_images_reloaded(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        filename = os.path.join(root, 'card.png')
+        png = b'\x89PNG\r\n\x1a\n'
+
+        with override_settings(STATICFILES_DIRS=[root],
+                               EMAIL_IMAGES=(('card', 'card.png'),)):
+            with open(filename, 'wb') as f:
+                f.write(png + b'old')
+            first = email_assets.get_images()
+            self.assertIs(email_assets.get_images(), first)
+
+            with open(filename, 'wb') as f:
+                f.write(png + b'new')
+            mtime = os.path.getmtime(filename) + 10
+            os.utime(filename, (mtime, mtime))
+            images = email_assets.get_images()
+            self.assertIsNot(images, first)
+            self.assertEqual(images[0].get_payload(decode=True), png + b'new')
+
+
+class CustomerImportTest(TestCase):
+    def setUp(self):
+        when = datetime(2015, 3, 4, 23, 30, 15, tzinfo=timezone.utc)
+        for i, customer in enumerate(create_customers(20)):
+            customer.when_created = when - timedelta(days=i * 10)
+            customer.save()
+
+    def reimport(self, fmtr, fmt):
+        data = fmtr.format(Customer.objects.order_by('pk'))
+        importer, errors = import_file(StringIO(data), fmt)
+        self.assertFalse(errors)
+        self.assertEqual(importer.created, 20)
+
+    def get_dates(self, get_date):
+        return {c.email: get_date(c) for c in Customer.objects.all()}
+
+    def test_csv_keeps_validity(self):
+        expected = self.get_dates(Customer.card_valid_since)
+        self.reimport(as_csv, 'csv')
+        self.assertEqual(self.get_dates(Customer.card_valid_since), expected)
+
+    def test_xlsx_keeps_when_created(self):
+        expected = self.get_dates(lambda c: c.when_created)
+        self.reimport(as_xlsx, 'xlsx')
+        self.assertEqual(self.get_dates(lambda c: c.when_created), expected)
+
+
+class BrokenImportRunner(ImportRunner):
+    def track_import(self, job, importer):
+        raise DatabaseError('Connection lost')
+
+
+class ImportRunnerTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.settings = override_settings(IMPORT_ROOT=self.root)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        create_customers(10)
+
+    def queue(self, data):
+        job = ImportJob.objects.create(fmt='csv', filename='customers.csv')
+        with open(job.get_path(), 'wb') as f:
+            f.write(data)
+        return job
+
+    def process(self, runner):
+        with patch_logger('content.jobs', 'exception'):
+            runner.process()
+
+    def test_retry_after_failure(self):
+        job = self.queue(as_csv.format(Customer.objects.all()))
+        self.process(BrokenImportRunner())
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertTrue(os.path.exists(job.get_path()))
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        self.client.post('/admin/content/importjob/',
+                         {'action': 'retry', '_selected_action': [job.pk]})
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.PENDING)
+
+        self.process(ImportRunner())
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.DONE)
+        self.assertEqual(job.rows_done, 10)
+        self.assertFalse(os.path.exists(job.get_path()))
+
+    def test_rejected_file_removed(self):
+        job = self.queue(b'x;y\n')
+        self.process(ImportRunner())
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertTrue(job.report)
+        self.assertFalse(os.path.exists(job.get_path()))
+
+    def test_cleanup(self):
+        job = self.queue(b'')
+        ImportJob.objects.filter(pk=job.pk).update(
+            status=JobStatus.FAILED,
+            when_created=timezone.now() - timedelta(days=30)
+        )
+        ImportRunner().cleanup()
+        self.assertFalse(os.path.exists(job.get_path()))
+        job.refresh_from_db()
+        self.assertEqual(job.filename, '')
+
+    def test_update_committed(self):
+        job = self.queue(b'')
+        runner = ImportRunner()
+        runner.update_committed(job, connection, {'rows_done': 5,
+                                                  'report': 'Отчёт'})
+        job.refresh_from_db()
+        self.assertEqual((job.rows_done, job.report), (5, 'Отчёт'))
+
+
+class ConfigSaveTest(TestCase):
+    def test_rebuild_on_range_change(self):
+        conf = SiteConfiguration.get_solo()
+        FreeCard.objects.rebuild()
+        FreeCard.objects.filter(card=conf.card_end).delete()
+
+        conf = SiteConfiguration.get_solo()
+        conf.email_subject = 'Другая тема'
+        conf.save()
+        self.assertFalse(FreeCard.objects.filter(card=conf.card_end).exists())
+
+        conf = SiteConfiguration.get_solo()
+        conf.card_end += 10
+        conf.save()
+        self.assertEqual(FreeCard.objects.count(), conf.get_cards_count())
+
+
+class SignupTest(TestCase):
+    def setUp(self):
+        FreeCard.objects.rebuild()
+
+    def get_customer(self, **kwargs):
+        fields = dict(first_name='Иван', middle_name='Иванович',
+                      last_name='Иванов', email='ivanov@example.com',
+                      phone='0123456789', ins_end=date(2030, 1, 1),
+                      utm_link='http://example.com/')
+        fields.update(kwargs)
+        return Customer(**fields)
+
+    def test_query_budget(self):
+        avail = Customer.objects.avail_cards_count()
+        # Sets the session up and loads the active texts
+        self.client.get('/')
+        # Session, then the signup transaction: savepoint, config lock,
+        # stock, free card lookup and removal, stock update, customer and
+        # email task inserts, savepoint release; then the texts version
+        with self.assertNumQueries(11):
+            response = self.client.post('/', {
+                'fullname': 'Иванов Иван Иванович',
+                'email': 'ivanov@example.com', 'phone': '0123456789',
+                'ins_end': '01/01/2030',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cards_avail'], avail - 1)
+        customer = Customer.objects.get()
+        self.assertIsNotNone(customer.card)
+        self.assertTrue(customer.utm_link)
+        self.assertEqual(customer.emails.count(), 1)
+        self.assertEqual(Customer.objects.avail_cards_count(), avail - 1)
+
+    def test_card_change_locked(self):
+        Customer.objects.signup(self.get_customer())
+        customer = Customer.objects.get()
+        card = FreeCard.objects.order_by('card').values_list('card',
+                                                              flat=True)[0]
+        avail = Customer.objects.avail_cards_count()
+
+        locks = []
+        lock_config = FreeCard.objects.lock_config
+        FreeCard.objects.lock_config = lambda: locks.append(1) or \
+            lock_config()
+        self.addCleanup(delattr, FreeCard.objects, 'lock_config')
+
+        customer.card = card
+        customer.save()
+        # One for claiming the new card, one for releasing the old one
+        self.assertEqual(len(locks), 2)
+        self.assertFalse(FreeCard.objects.filter(card=card).exists())
+        self.assertEqual(Customer.objects.avail_cards_count(), avail)
+        self.assertEqual(FreeCard.objects.count(), avail)
+
+    def test_duplicate(self):
+        Customer.objects.signup(self.get_customer())
+        avail = Customer.objects.avail_cards_count()
+        with self.assertRaises(ValidationError) as cm:
+            Customer.objects.signup(self.get_customer(phone='0987654321'))
+        self.assertIn('email', cm.exception.message_dict)
+        self.assertEqual(Customer.objects.count(), 1)
+        self.assertEqual(Customer.objects.avail_cards_count(), avail)
+        self.assertEqual(FreeCard.objects.count(), avail)
+
+
+class PurgeTest(TestCase):
+    def setUp(self):
+        EmailTask.objects.bulk_create([EmailTask(customer=customer)
+                                       for customer in create_customers(25)])
+
+    def test_archive(self):
+        expected = dict(EmailTask.objects.filter(customer__card__gt=5)
+                        .values_list('customer', 'token'))
+        purger = Purger(Customer.objects.filter(card__gt=5), archive=True)
+        purger.chunk_size = 7
+        purger.run()
+        self.assertEqual(purger.rows_done, 20)
+        self.assertEqual(Customer.objects.count(), 5)
+        self.assertEqual(EmailTask.objects.count(), 5)
+        self.assertEqual(CustomerArchive.objects.count(), 20)
+        self.assertEqual(dict(EmailTaskArchive.objects
+                              .values_list('customer__source_id', 'token')),
+                         expected)
+
+    def test_archived_cards_reserved(self):
+        Purger(Customer.objects.filter(card__gt=20), archive=True).run()
+        FreeCard.objects.rebuild()
+        self.assertFalse(FreeCard.objects.filter(card__gt=20,
+                                                 card__lte=25).exists())
+        self.assertEqual(FreeCard.objects.count(),
+                         Customer.objects.count_avail_cards())
+
+        customer = Customer.objects.get(card=1)
+        customer.card = 21
+        with self.assertRaises(ValidationError) as cm:
+            customer.full_clean()
+        self.assertIn('card', cm.exception.message_dict)
+
+        data = as_csv.format(Customer.objects.filter(card=2))
+        data = data.replace(b'UTK 2;', b'UTK 22;')
+        importer = import_file(StringIO(data), 'csv', upsert=True)[0]
+        self.assertIn('Карта выдана архивному пользователю',
+                      ' '.join(importer.get_error_messages()))
+
+    def test_delete(self):
+        Purger().run()
+        self.assertFalse(Customer.objects.exists())
+        self.assertFalse(EmailTask.objects.exists())
+        self.assertEqual(FreeCard.objects.count(),
+                         Customer.objects.avail_cards_count())
+
+
+class LandingPageTest(TestCase):
+    def setUp(self):
+        FreeCard.objects.rebuild()
+
+    def test_cached_page_shows_cards(self):
+        avail = Customer.objects.avail_cards_count()
+        response = self.client.get('/')
+        self.assertContains(response, '<b>%d</b>' % avail)
+
+        def render_page(view):
+            raise AssertionError('The page is rendered again')
+        self.addCleanup(setattr, LandingView, 'render_page',
+                        LandingView.__dict__['render_page'])
+        LandingView.render_page = render_page
+
+        Customer.objects.signup(Customer(
+            first_name='Иван', middle_name='Иванович', last_name='Иванов',
+            email='ivanov@example.com', phone='0123456789',
+            ins_end=date(2030, 1, 1)
+        ))
+        response = self.client.get('/')
+        self.assertContains(response, '<b>%d</b>' % (avail - 1))
+        self.assertNotContains(response, LandingView.csrf_placeholder)
+
+
+class QueryPlansTest(TestCase):
+    def test_indexes_used(self):
+        create_customers(100)
+        # Raises CommandError if a query does not use its index
+        call_command('check_query_plans', stdout=StringIO())
+
+
+class CompressedExportTest(TestCase):
+    rows = [('Строка %d' % i, i) for i in xrange(5000)]
+
+    def test_gzip(self):
+        data = GzipFormatter(CSVFormatter()).format(self.rows)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(data)).read(),
+                         CSVFormatter().format(self.rows))
+
+    def assertZip(self, fmtr):
+        archive = zipfile.ZipFile(StringIO(fmtr.format(self.rows)))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ['клиенты.csv'])
+        self.assertEqual(archive.read('клиенты.csv'),
+                         CSVFormatter().format(self.rows))
+
+    def test_xlsx(self):
+        when = datetime(2021, 3, 4, 5, 6, 7)
+        rows = [('Строка <%d> & "x"\x01' % i, i, 2.5, date(2020, 1, 2),
+                 when.replace(tzinfo=timezone.utc), None, True)
+                for i in xrange(1200)]
+        data = XLSXFormatter().format(rows)
+        self.assertIsNone(zipfile.ZipFile(StringIO(data)).testzip())
+        self.assertEqual(list(read_xlsx(StringIO(data))), [
+            ('Строка <%d> & "x"' % i, i, 2.5, datetime(2020, 1, 2), when,
+             None, True)
+            for i in xrange(1200)
+        ])
+
+    def test_zip(self):
+        self.assertZip(ZipFormatter(CSVFormatter(), 'клиенты.csv'))
+
+    def test_zip64(self):
+        fmtr = ZipFormatter(CSVFormatter(), 'клиенты.csv')
+        # Archives over the limit end with the ZIP64 records
+        fmtr.zip64_limit = 1000
+        self.assertZip(fmtr)
@@ -1,27 +1,54 @@
 from django.conf import settings
-from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.lru_cache import lru_cache
 from django.shortcuts import render
 from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
 from django.views.generic import View
 from django.core.exceptions import ValidationError
 from django.views.generic.base import ContextMixin
 from django.views.decorators.http import require_GET
 
-from content.models import Text, EmailTask, Service, Customer
+from config.cache import PageCache
+from content.models import Text, EmailTask, Service, Customer, \
+    landing_version
 from content.forms import CustomerForm, EmailTokenForm
 
 
+landing_pages = PageCache('landing:page', timeout=60 * 60)
+
+
 class LandingView(ContextMixin, View):
+    # Rendered into the cached page instead of the per-visitor token and
+    # the card counter, which changes with every signup
+    csrf_placeholder = '__csrf_token__'
+    cards_placeholder = '__cards_avail__'
+
     def get_context_data(self, **kwargs):
         ctx = super(LandingView, self).get_context_data(**kwargs)
         ctx['services'] = Service.objects.active()
-        ctx['texts'] = {t.place: t for t in Text.objects.active()}
+        ctx['texts'] = Text.get_active()
         ctx['cards_avail'] = Customer.objects.avail_cards_count()
         return ctx
 
+    def render_page(self):
+        """
+        Renders the page shared by all visitors, without the request and
+        its context processors.
+        """
+        ctx = self.get_context_data(form=CustomerForm(),
+                                    csrf_token=self.csrf_placeholder)
+        ctx['cards_avail'] = self.cards_placeholder
+        return render_to_string('index.html', ctx)
+
     def get(self, request):
-        return render(request, 'index.html',
-                      self.get_context_data(form=CustomerForm()))
+        content = landing_pages.get([landing_version.get()], self.render_page)
+        cards_avail = Customer.objects.avail_cards_count()
+        return HttpResponse(
+            content.replace(self.csrf_placeholder, get_token(request))
+                   .replace(self.cards_placeholder, str(cards_avail))
+        )
 
     def post(self, request):
         form = CustomerForm(request.POST)
@@ -33,37 +60,32 @@ class LandingView(ContextMixin, View):
             customer['utm_link'] = request.session.get('utm')
             customer = Customer(**customer)
             try:
-                customer.validate_unique()
+                cards_avail = Customer.objects.signup(customer)
             except ValidationError, e:
                 for field, msg in e.message_dict.iteritems():
                     form.add_error(field, msg)
             else:
-                customer.save()
-                try:
-                    tpl = Text.objects.active().get(place=Text.PLACE.SUCCESS)
-                except Text.DoesNotExist:
-                    msg = None
-                else:
-                    msg = tpl.render(data=customer)
+                tpl = Text.get_active().get(Text.PLACE.SUCCESS)
+                msg = None if tpl is None else tpl.render(data=customer)
                 return render(request, 'index.html',
-                              {'msg': msg, 'valid': True, 'cards_avail': Customer.objects.avail_cards_count()})
+                              {'msg': msg, 'valid': True, 'cards_avail': cards_avail})
         return render(request, 'index.html', self.get_context_data(form=form),
                       status=400)
 
 
+@lru_cache(maxsize=None)
+def get_dummy_image():
+    with open(settings.DUMMY_IMAGE, 'rb') as f:
+        return f.read()
+
+
 @require_GET
 def email_opened(request):
     form = EmailTokenForm(request.GET)
     if form.is_valid():
-        try:
-            email = EmailTask.objects.get(when_opened=None,
-                                          token=form.cleaned_data['token'])
-        except EmailTask.DoesNotExist:
-            pass
-        else:
-            email.when_opened = timezone.now()
-            email.save()
+        EmailTask.objects.mark_opened(form.cleaned_data['token'])
 
-    with open(settings.DUMMY_IMAGE) as f:
-        img = f.read()
-    return HttpResponse(content=img, content_type='image/png')
+    response = HttpResponse(content=get_dummy_image(),
+                            content_type='image/png')
+    patch_cache_control(response, private=True, max_age=60 * 60 * 24 * 30)
+    return response
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
-import re
-from cStringIO import StringIO
+import os
 
+from django.conf import settings
 from django.http import HttpResponse
 from django.views.generic.base import ContextMixin
 from django.core.exceptions import ImproperlyConfigured
@@ -10,12 +10,14 @@ from django.core.urlresolvers import reverse
 from django.views.generic import View
 from django.shortcuts import render
 from django.utils import timezone
-from django.contrib import admin
+from django.utils.crypto import get_random_string
+from django.contrib import admin, messages
 from django.apps import apps
-from openpyxl import Workbook, load_workbook
 
-from content.models import Customer, EmailStatus, EmailTask
-from content.forms import ImportForm
+from content.models import Customer, ImportJob, PurgeJob
+from content.forms import ImportForm, PurgeForm
+from content.imports.customer import import_file
+from content.purge import Purger
 
 
 class HttpResponseSeeOther(HttpResponse):
@@ -72,52 +74,39 @@ class ImportView(CleanPermMixin, View):
         return render(request, self.template_name,
                       self.get_context_data(form=ImportForm()))
 
+    def queue(self, request, data, fmt, upsert):
+        """
+        Stores the uploaded file for a background import job.
+        """
+        if not os.path.isdir(settings.IMPORT_ROOT):
+            os.makedirs(settings.IMPORT_ROOT)
+        now = timezone.now().strftime('%Y_%m_%d_%H_%M')
+        filename = 'customers_%s_%s.%s' % (now, get_random_string(8), fmt)
+        with open(os.path.join(settings.IMPORT_ROOT, filename), 'wb') as f:
+            for chunk in data.chunks():
+                f.write(chunk)
+        return ImportJob.objects.create(user=request.user, fmt=fmt,
+                                        upsert=upsert, filename=filename)
+
     def post(self, request):
         form = ImportForm(request.POST, request.FILES)
         if form.is_valid():
-            wb = load_workbook(request.FILES['data'], read_only=True)
-            ws = wb.active
-            ids = {v: k for k, v in EmailStatus._DISPLAY.iteritems()}
-            customers = []
-            errors = set()
-            card_re = re.compile(r'.*?(\d+)$')
-            for row in ws.rows:
-                c = {k: row[i].value for i, k in enumerate(('when_created',
-                                                            'card',
-                                                            'last_name',
-                                                            'first_name',
-                                                            'middle_name',
-                                                            'email',
-                                                            'phone',
-                                                            'ins_end',
-                                                            'email_status',
-                                                            'source',
-                                                            'utm_link'))}
-                del c['source']
-                if c['card']:
-                    m = card_re.match(c['card'])
-                    if m:
-                        c['card'] = int(m.group(1))
-                    else:
-                        errors.add('Неправильный формат карты: %s' % c['card'])
-                        continue
-                try:
-                    c['email_status'] = ids[row[8].value]
-                except IndexError:
-                    errors.add(('Не указан статус письма',))
-                    continue
-                except KeyError:
-                    errors.add(('Неверно указан статус письма', row[8].value))
-                    continue
-                customers.append(Customer(**c))
-
+            upsert = form.cleaned_data['mode'] == ImportForm.UPSERT
+            if form.cleaned_data['background']:
+                self.queue(request, form.cleaned_data['data'],
+                           form.cleaned_data['fmt'], upsert)
+                messages.success(request, 'Импорт поставлен в очередь')
+                return HttpResponseSeeOther(
+                    location=reverse('admin:content_importjob_changelist')
+                )
+            importer, errors = import_file(request.FILES['data'],
+                                           form.cleaned_data['fmt'], upsert)
             if errors:
-                for err in errors:
-                    form.add_error(None, ': '.join(err))
+                for msg in importer.get_error_messages():
+                    form.add_error(None, msg)
             else:
-                EmailTask.objects.all().delete()
-                Customer.objects.all().delete()
-                Customer.objects.bulk_create(customers)
+                messages.success(request, 'Добавлено: %d, обновлено: %d'
+                                 % (importer.created, importer.updated))
                 return HttpResponseSeeOther(
                     location=reverse('admin:content_customer_changelist')
                 )
@@ -128,13 +117,27 @@ class ImportView(CleanPermMixin, View):
 class CleanView(CleanPermMixin, View):
     title = 'Обнулить'
 
+    template_name = 'admin/confirm_clean.html'
+
     def get(self, request):
-        return render(request, 'admin/confirm_clean.html',
-                      self.get_context_data())
+        return render(request, self.template_name,
+                      self.get_context_data(form=PurgeForm()))
 
     def post(self, request):
-        EmailTask.objects.all().delete()
-        Customer.objects.all().delete()
+        form = PurgeForm(request.POST)
+        if not form.is_valid():
+            return render(request, self.template_name, status=400,
+                          context=self.get_context_data(form=form))
+        archive = form.cleaned_data['archive']
+        if form.cleaned_data['background']:
+            PurgeJob.objects.create(user=request.user, archive=archive)
+            messages.success(request, 'Очистка поставлена в очередь')
+            return HttpResponseSeeOther(
+                location=reverse('admin:content_purgejob_changelist')
+            )
+        purger = Purger(archive=archive)
+        purger.run()
+        messages.success(request, purger.get_report())
         return HttpResponseSeeOther(
             location=reverse('admin:content_customer_changelist')
         )
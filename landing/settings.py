@@ -92,6 +92,18 @@ DATABASES = {
     }
 }
 
+# Shared between workers; create the table with `manage.py createcachetable`
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'cache',
+    }
+}
+
+# Seconds a process outside of a request trusts in-memory copies of
+# cached objects before checking their version
+LOCAL_CACHE_TIMEOUT = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
@@ -153,6 +165,22 @@ SITE_URL = DEV_SITE_URL
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'static')
 
+# Files made by background export jobs and the days they are kept for
+EXPORT_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'exports')
+EXPORT_RETENTION_DAYS = 7
+
+# Uploaded files waiting for background import jobs and the days the files
+# of failed jobs are kept for a retry
+IMPORT_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'imports')
+IMPORT_RETENTION_DAYS = 7
+
+# Inline images of the email: (Content-ID, path inside static files)
+EMAIL_IMAGES = (
+    ('card_image', 'img/card-h.png'),
+    ('logo', 'img/logo.png'),
+    ('bac_logo', 'img/BAC_Logo.png'),
+)
+
 # Image to check when user opens an email
 DUMMY_IMAGE = os.path.join(BASE_DIR, 'transp.png')
 